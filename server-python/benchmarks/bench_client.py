@@ -0,0 +1,233 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Benchmark of the connection layers, StreamClient against ProtocolClient.
+#
+#   PYTHONPATH=./cgos python3 benchmarks/bench_client.py [options]
+#
+# Starts an echo server on the loopback interface with each layer in
+# turn, connects --clients sockets and has every socket do --rounds
+# request/response round trips, all sockets at once.  A response is two
+# send() calls, like "setup" followed by "genmove".  Reported are the
+# round trips per second, round trip latency, CPU time per round trip,
+# the number of asyncio tasks, the memory allocated per idle connection
+# and the transport writes per message sent.  The client side is the
+# same for both layers.
+#
+# The broadcast part connects --viewers sockets which only read, and
+# sends them --broadcasts update messages, once with a send() per
+# viewer and once with broadcast() which encodes each message once.
+# Reported are the fan-out time of one broadcast on the server and the
+# time until every viewer has read every message.
+#
+# Logging is as configured in log.ini, run from its directory.  --trace
+# sets the connections whose messages are logged: "off" traces none,
+# "sampled" 1% at INFO, and "all" every connection at DEBUG, which the
+# handlers of log.ini drop; that is what the per-message debug logs cost
+# before they were guarded.
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import tracemalloc
+from typing import Dict, List
+
+from app.client import Client, ProtocolClient, StreamClient, broadcast, wireTrace
+
+
+def percentiles(samples: List[int]) -> Dict[str, float]:
+    s = sorted(samples)
+    n = len(s)
+
+    def at(q: float) -> float:
+        return s[min(n - 1, int(q * n))] / 1000.0  # ns -> us
+
+    return {"p50_us": at(0.50), "p90_us": at(0.90), "p99_us": at(0.99), "max_us": at(1.0)}
+
+
+# server side clients, in the order they connected
+connected: List[Client] = []
+
+
+def echo(client: Client, line: str) -> None:
+    i = line.strip()[5:]
+    client.send("info " + i)
+    client.send("pong " + i)
+
+
+async def serve_stream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    client = StreamClient(reader, writer, "bench")
+    connected.append(client)
+
+    async def handle() -> None:
+        while client.alive:
+            echo(client, await client.readLine())
+
+    tasks = [
+        asyncio.create_task(client.readTask()),
+        asyncio.create_task(client.writeTask()),
+        asyncio.create_task(handle()),
+    ]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for t in pending:
+        t.cancel()
+
+
+async def start(layer: str) -> asyncio.AbstractServer:
+    if layer == "stream":
+        return await asyncio.start_server(serve_stream, "127.0.0.1", 0)
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(
+        lambda: ProtocolClient(connected.append, echo, lambda c: None), "127.0.0.1", 0
+    )
+
+
+async def peer(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, rounds: int, samples: List[int]
+) -> None:
+    clock = time.perf_counter_ns
+    for i in range(rounds):
+        t = clock()
+        writer.write(f"ping {i}\n".encode())
+        await reader.readline()
+        line = await reader.readline()
+        samples.append(clock() - t)
+        assert line == f"pong {i}\n".encode()
+
+
+async def run_layer(layer: str, clients: int, rounds: int) -> Dict[str, float]:
+    server = await start(layer)
+    port = server.sockets[0].getsockname()[1]
+    connected.clear()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    conns = [await asyncio.open_connection("127.0.0.1", port) for _ in range(clients)]
+    # one round trip each so every connection is set up on the server
+    warm: List[int] = []
+    await asyncio.gather(*[peer(r, w, 1, warm) for r, w in conns])
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    tasks = len(asyncio.all_tasks())
+
+    samples: List[int] = []
+    t = time.perf_counter()
+    cpu = time.process_time()
+    await asyncio.gather(*[peer(r, w, rounds, samples) for r, w in conns])
+    cpu = time.process_time() - cpu
+    elapsed = time.perf_counter() - t
+    messages = sum(c.messages for c in connected)
+    writes = sum(c.writes for c in connected)
+
+    for _, w in conns:
+        w.close()
+    server.close()
+    await server.wait_closed()
+    await asyncio.sleep(0.1)
+
+    ret = {
+        "round_trips_per_sec": len(samples) / elapsed,
+        "tasks": float(tasks),
+        "kb_per_connection": memory / 1024.0 / clients,
+        "writes_per_message": writes / max(1, messages),
+        "cpu_us_per_round_trip": 1e6 * cpu / len(samples),
+    }
+    ret.update(percentiles(samples))
+    return ret
+
+
+async def viewer(reader: asyncio.StreamReader, count: int) -> None:
+    for _ in range(count):
+        await reader.readline()
+
+
+async def run_broadcast(layer: str, viewers: int, broadcasts: int, once: bool) -> Dict[str, float]:
+    server = await start(layer)
+    port = server.sockets[0].getsockname()[1]
+    connected.clear()
+    conns = [await asyncio.open_connection("127.0.0.1", port) for _ in range(viewers)]
+    while len(connected) < viewers:
+        await asyncio.sleep(0.01)
+    clients = list(connected)
+    readers = [asyncio.create_task(viewer(r, broadcasts)) for r, _ in conns]
+
+    samples = []
+    clock = time.perf_counter_ns
+    start_t = clock()
+    for i in range(broadcasts):
+        msg = f"update {i} Q16 {900000 - i} ..."
+        t = clock()
+        if once:
+            broadcast(clients, msg)
+        else:
+            for c in clients:
+                c.send(msg)
+        samples.append(clock() - t)
+        # let the transports and write tasks run, as between moves
+        await asyncio.sleep(0)
+    await asyncio.gather(*readers)
+    delivered = (clock() - start_t) / 1e6
+
+    for _, w in conns:
+        w.close()
+    server.close()
+    await server.wait_closed()
+    await asyncio.sleep(0.1)
+
+    ret = {"delivered_ms": delivered}
+    ret.update({"fanout_" + k: v for k, v in percentiles(samples).items()})
+    return ret
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark the connection layers")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20, help="round trips per client")
+    parser.add_argument("--viewers", type=int, default=1000)
+    parser.add_argument("--broadcasts", type=int, default=8, help="messages to the viewers")
+    parser.add_argument("--trace", choices=["off", "sampled", "all"], default="off")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.trace == "sampled":
+        wireTrace.configure(0.01)
+    elif args.trace == "all":
+        wireTrace.configure(1.0, logging.DEBUG)
+    results: Dict[str, Dict[str, float]] = {}
+    for layer in ["stream", "protocol"]:
+        results[layer] = asyncio.run(run_layer(layer, args.clients, args.rounds))
+        for name, once in [("send", False), ("broadcast", True)]:
+            results[f"{layer}-{name}"] = asyncio.run(
+                run_broadcast(layer, args.viewers, args.broadcasts, once)
+            )
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
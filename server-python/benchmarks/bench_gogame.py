@@ -0,0 +1,242 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Benchmark of the gogame hot paths.
+#
+#   PYTHONPATH=./cgos python3 benchmarks/bench_gogame.py [options]
+#
+# Inputs are seeded random legal playouts, plus recorded games when
+# --archive points to a game archive database.  Results can be saved as
+# a baseline JSON file and later runs compared against it; the exit
+# status is 1 when a gated metric regressed by more than --tolerance.
+
+import argparse
+import datetime
+import json
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+from gogame import Game, GoGame, KoRule, Move, Rule, sgf
+from gogame.playout import random_playout
+
+
+SIZES = [9, 13, 19]
+
+# metrics where a larger value is better, everything else is a cost
+HIGHER_IS_BETTER = ("per_sec",)
+
+# metrics compared with the baseline.  With 20 samples per scenario p90
+# and p99 are close to the maximum and swing from run to run, they are
+# reported only
+GATED = ("per_sec", "p50_us", "peak_kb")
+
+
+def percentiles(samples: List[int]) -> Dict[str, float]:
+    s = sorted(samples)
+    n = len(s)
+
+    def at(q: float) -> float:
+        return s[min(n - 1, int(q * n))] / 1000.0  # ns -> us
+
+    return {"p50_us": at(0.50), "p90_us": at(0.90), "p99_us": at(0.99), "max_us": at(1.0)}
+
+
+def playout_games(size: int, count: int, seed: int) -> List[List[str]]:
+    rng = random.Random(seed + size)
+    games = []
+    for _ in range(count):
+        game = GoGame(size, Rule(KoRule.POSITIONAL))
+        random_playout(game, rng)
+        games.append(game.list_moves())
+    return games
+
+
+def archive_games(path: str, size: int, count: int) -> List[List[str]]:
+    db = sqlite3.connect(path)
+    games = []
+    for (dta,) in db.execute("SELECT dta FROM games ORDER BY gid DESC"):
+        tokens = dta.split()
+        if len(tokens) < 8 or tokens[2] != str(size):
+            continue
+        moves = tokens[7:-1:2]
+        if len(moves) > 0 and moves[-1].lower() == "resign":
+            moves.pop()
+        games.append(moves)
+        if len(games) >= count:
+            break
+    db.close()
+    return games
+
+
+def bench_make(games: List[List[str]], size: int) -> Dict[str, float]:
+    samples = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for moves in games:
+        game = GoGame(size, Rule(KoRule.POSITIONAL))
+        for mv in moves:
+            t = clock()
+            game.make(mv)
+            samples.append(clock() - t)
+    elapsed = (clock() - start) / 1e9
+    ret = {"moves_per_sec": len(samples) / elapsed}
+    ret.update(percentiles(samples))
+    return ret
+
+
+def bench_replay(games: List[List[str]], size: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    n = 0
+    for moves in games:
+        game = GoGame(size, Rule(KoRule.POSITIONAL))
+        game.replay(moves)
+        n += len(moves)
+    return {"moves_per_sec": n / (time.perf_counter() - start)}
+
+
+def bench_score(games: List[List[str]], size: int) -> Dict[str, Dict[str, float]]:
+    boards = []
+    for moves in games:
+        game = GoGame(size, Rule(KoRule.POSITIONAL))
+        game.replay(moves)
+        boards.append(game)
+    ret = {}
+    for name, f in [
+        ("score_board", lambda g: g.score_board([])),
+        ("ttScore", lambda g: g.ttScore()),
+    ]:
+        samples = []
+        for game in boards:
+            t = time.perf_counter_ns()
+            f(game)
+            samples.append(time.perf_counter_ns() - t)
+        r = {"calls_per_sec": 1e9 * len(samples) / sum(samples)}
+        r.update(percentiles(samples))
+        ret[name] = r
+    return ret
+
+
+def bench_sgf(games: List[List[str]], size: int) -> Dict[str, float]:
+    samples = []
+    ctime = datetime.datetime(2023, 1, 1)
+    for moves in games:
+        record = Game("w", "b", 0, 0, 0, "1800", "1800",
+                      [Move(mv, 900000, None, None) for mv in moves], ctime)
+        t = time.perf_counter_ns()
+        sgf(record, "cgos", 900000, "Chinese", size, 7.5, 1, "?", "2023-01-01", "")
+        samples.append(time.perf_counter_ns() - t)
+    ret = {"calls_per_sec": 1e9 * len(samples) / sum(samples)}
+    ret.update(percentiles(samples))
+    return ret
+
+
+def bench_memory(games: List[List[str]], size: int) -> Dict[str, float]:
+    peaks = []
+    for moves in games[:5]:
+        tracemalloc.start()
+        game = GoGame(size, Rule(KoRule.POSITIONAL))
+        for mv in moves:
+            game.make(mv)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del game
+    return {"peak_kb": max(peaks) / 1024.0}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, object]]:
+    results: Dict[str, Dict[str, object]] = {}
+    for size in args.sizes:
+        inputs = {"playout": playout_games(size, args.games, args.seed)}
+        if args.archive is not None:
+            recorded = archive_games(args.archive, size, args.games)
+            if len(recorded) > 0:
+                inputs["archive"] = recorded
+        for source, games in inputs.items():
+            key = f"{source}-{size}"
+            length = sum(map(len, games)) / len(games)
+            print(f"{key}: {len(games)} games, {length:.0f} moves per game", file=sys.stderr)
+            results[key] = {
+                "make": bench_make(games, size),
+                "replay": bench_replay(games, size),
+                **bench_score(games, size),
+                "sgf": bench_sgf(games, size),
+                "memory": bench_memory(games, size),
+            }
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, object]], baseline: Dict[str, Dict[str, object]], tolerance: float
+) -> List[str]:
+    regressions = []
+    for key, groups in baseline.items():
+        for group, metrics in groups.items():
+            current = results.get(key, {}).get(group)
+            if not isinstance(metrics, dict) or not isinstance(current, dict):
+                continue
+            for metric, base in metrics.items():
+                if metric not in current or not metric.endswith(GATED):
+                    continue
+                value = current[metric]
+                if metric.endswith(HIGHER_IS_BETTER):
+                    bad = value < base * (1.0 - tolerance)
+                else:
+                    bad = value > base * (1.0 + tolerance)
+                if bad:
+                    regressions.append(f"{key} {group} {metric}: {base:.1f} -> {value:.1f}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark the gogame package")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--games", type=int, default=20, help="games per size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--archive", help="game archive database for recorded games")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare with a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}", file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Random playout stress driver for GoGame.
+#
+#   PYTHONPATH=./cgos python3 benchmarks/stress_gogame.py [options]
+#
+# Plays seeded random legal games over the given sizes and ko rules,
+# optionally in a multiprocessing pool, then replays each game timing
+# every make() call.  The slowest moves are reported with the position
+# they were played on; --export writes those positions as to_string()
+# text files which GoGame.from_string reads back as regression fixtures.
+
+import argparse
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from gogame import GoGame, KoRule, Rule
+from gogame.playout import random_playout
+
+
+class Task:
+    size: int
+    koRule: KoRule
+    first: int  # seed of the first game
+    games: int
+    worst: int  # number of slowest moves to keep
+
+    def __init__(self, size: int, koRule: KoRule, first: int, games: int, worst: int) -> None:
+        self.size = size
+        self.koRule = koRule
+        self.first = first
+        self.games = games
+        self.worst = worst
+
+
+# (latency ns, size, ko rule name, seed, ply, moves up to and including the slow one)
+Slow = Tuple[int, int, str, int, int, List[str]]
+
+
+class Result:
+    games: int
+    moves: int
+    captures: int  # moves which captured stones
+    make_ns: int  # time spent in timed make() calls
+    slowest: List[Slow]
+
+    def __init__(self) -> None:
+        self.games = 0
+        self.moves = 0
+        self.captures = 0
+        self.make_ns = 0
+        self.slowest = []
+
+    def add(self, other: "Result", worst: int) -> None:
+        self.games += other.games
+        self.moves += other.moves
+        self.captures += other.captures
+        self.make_ns += other.make_ns
+        self.slowest = heapq.nlargest(worst, self.slowest + other.slowest)
+
+
+# play and time the games of one task
+# -----------------------------------
+def run_task(task: Task) -> Result:
+    res = Result()
+    rule = Rule(task.koRule)
+    clock = time.perf_counter_ns
+    heap: List[Slow] = []
+    for seed in range(task.first, task.first + task.games):
+        game = GoGame(task.size, rule)
+        random_playout(game, random.Random(seed))
+        moves = game.list_moves()
+
+        game = GoGame(task.size, rule)
+        for ply, mv in enumerate(moves):
+            t = clock()
+            game.make(mv)
+            dt = clock() - t
+            res.make_ns += dt
+            if len(heap) < task.worst or dt > heap[0][0]:
+                slow = (dt, task.size, task.koRule.name, seed, ply, moves[:ply + 1])
+                if len(heap) < task.worst:
+                    heapq.heappush(heap, slow)
+                else:
+                    heapq.heapreplace(heap, slow)
+            if len(game.undo[-1][1]) > 0:
+                res.captures += 1
+        res.games += 1
+        res.moves += len(moves)
+    res.slowest = heap
+    return res
+
+
+# split the games of every size and ko rule into chunks
+# -----------------------------------------------------
+def make_tasks(
+    sizes: List[int], rules: List[KoRule], games: int, chunk: int, seed: int, worst: int
+) -> Iterator[Task]:
+    for size, koRule in itertools.product(sizes, rules):
+        for first in range(0, games, chunk):
+            yield Task(size, koRule, seed + first, min(chunk, games - first), worst)
+
+
+# write the position before each slow move for from_string
+# --------------------------------------------------------
+def export(slowest: List[Slow], directory: str) -> List[Dict[str, object]]:
+    os.makedirs(directory, exist_ok=True)
+    ret = []
+    for dt, size, koRule, seed, ply, moves in slowest:
+        game = GoGame(size, Rule(KoRule[koRule]))
+        game.replay(moves[:-1])
+        path = os.path.join(directory, f"{size}-{koRule.lower()}-{seed}-{ply}.txt")
+        with open(path, "w") as f:
+            f.write(game.to_string())
+        ret.append({"file": path, "move": moves[-1], "ctm": game.ctm})
+    return ret
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="random playout stress test of GoGame")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[9, 13, 19])
+    parser.add_argument(
+        "--rules", nargs="+", choices=[r.name for r in KoRule], default=[r.name for r in KoRule]
+    )
+    parser.add_argument("--games", type=int, default=1000, help="games per size and ko rule")
+    parser.add_argument("--chunk", type=int, default=100, help="games per worker task")
+    parser.add_argument("--processes", type=int, default=0, help="worker processes, 0 runs inline")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--worst", type=int, default=10, help="slowest moves to report")
+    parser.add_argument("--export", help="directory for the positions of the slowest moves")
+    args = parser.parse_args()
+
+    rules = [KoRule[r] for r in args.rules]
+    tasks = make_tasks(args.sizes, rules, args.games, args.chunk, args.seed, args.worst)
+
+    total = Result()
+    start = time.perf_counter()
+    if args.processes > 0:
+        with multiprocessing.Pool(args.processes) as pool:
+            for res in pool.imap_unordered(run_task, tasks):
+                total.add(res, args.worst)
+    else:
+        for res in map(run_task, tasks):
+            total.add(res, args.worst)
+    elapsed = time.perf_counter() - start
+
+    report: Dict[str, object] = {
+        "games": total.games,
+        "moves": total.moves,
+        "captures": total.captures,
+        "seconds": elapsed,
+        "games_per_sec": total.games / elapsed,
+        "make_per_sec": total.moves / (total.make_ns / 1e9),
+        "slowest": [
+            {"us": dt / 1000.0, "size": size, "rule": koRule, "seed": seed, "ply": ply, "move": moves[-1]}
+            for dt, size, koRule, seed, ply, moves in total.slowest
+        ],
+    }
+    if args.export:
+        report["exported"] = export(total.slowest, args.export)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -23,7 +23,6 @@
 
 import asyncio
 import datetime
-import gzip
 import sys
 import time
 import os
@@ -33,15 +32,23 @@ import re
 import traceback
 import json
 import shutil
-import zlib
 
-from typing import List, Tuple, Dict, Optional
+from typing import Iterable, List, Sequence, Tuple, Dict, Optional
 
 from passlib.context import CryptContext
 
-from gogame import GoGame, Game, Rule, sgf
-from .config import Configs, MatchMode
-from .client import Client
+from gogame import ERR_MSG, GoGame, Game, Move, MoveList, Rule, analysisComment, sgf, sgfHeader
+from .config import Configs, ConnectionMode, MatchMode
+from .client import (
+    VIEWER_POLICY,
+    Client,
+    ProtocolClient,
+    StreamClient,
+    broadcast,
+    broadcastStats,
+    wireTrace,
+)
+from .sgffile import SgfSave, SgfWriter
 from .rating import strRate, newrating
 from util.logutils import getLogger
 from util.timeutils import now_string, now_seconds, now_milliseconds
@@ -54,20 +61,9 @@ SKIP = 4
 ENCODING = "utf-8"
 ADMIN_USER = "admin"
 
-# Return: -4  if str_move formatted wrong
-# Return: -3  move to occupied square
-# Return: -2  Position Super Ko move
-# Return: -1  suicide
-ERR_MSG = [
-    "huh",
-    "suicide attempted",
-    "KO attempted",
-    "move to occupied point",
-    "do not understand syntax",
-]
-
 db: sqlite3.Connection
 dbrec: Optional[sqlite3.Connection]
+sgfWriter: SgfWriter
 
 gme: Dict[int, GoGame] = dict()
 
@@ -82,12 +78,12 @@ passctx: CryptContext
 cfg: Configs
 
 
-def joinMoves(moves: List[Tuple[str, int, Optional[str]]]) -> str:
-    return " ".join([f"{m} {t}" for (m, t, i) in moves])
+def joinMoves(moves: MoveList) -> str:
+    return moves.wire()
 
 
-def joinAnalysis(moves: List[Tuple[str, int, Optional[str]]]) -> str:
-    return "\n".join([i or "" for (m, t, i) in moves])
+def joinAnalysis(moves: Iterable[Move]) -> str:
+    return "\n".join([m.analysis or "" for m in moves])
 
 
 def initDatabase() -> None:
@@ -176,19 +172,18 @@ class ViewerList:
             del self.obs[gid]
 
     def sendAll(self, msg: str) -> None:
-        for who, v in list(self.vact.items()):
-            v.send(msg)
-            if not v.alive:
-                logger.error(f"[{who}] disconnected")
-                self.remove(who)
-
-    def sendObservers(self, gid: int, msg: str) -> None:
+        for v in broadcast(list(self.vact.values()), msg):
+            logger.error(f"[{v.id}] disconnected")
+            self.remove(v.id)
+
+    # "coalesce" lets a viewer which is behind replace the message by a
+    # resync of the game
+    # -----------------------------------------------------------------
+    def sendObservers(self, gid: int, msg: str, coalesce: bool = True) -> None:
         if gid not in self.obs:
             return
-        for vk in self.obs[gid]:
-            if vk not in self.vact:
-                continue
-            self.vact[vk].send(msg)
+        observers = (self.vact[vk] for vk in self.obs[gid] if vk in self.vact)
+        broadcast(observers, msg, gid=gid if coalesce else 0)
 
 
 # -------------------------------------------------------------------------
@@ -268,24 +263,22 @@ def is_admin(who: str) -> bool:
 # send an informational message out to all clients
 # -------------------------------------------------
 def infoMsg(msg: str) -> None:
-    for (who, v) in list(act.items()):
-        if v.msg_state != "protocol":
-            soc = v.sock
-            if not soc.send(f"info {msg}"):
-                logger.error(f"[{who}] disconnected")
-                soc.close()
-                del act[who]
+    players = [v.sock for v in act.values() if v.msg_state != "protocol"]
+    for soc in broadcast(players, f"info {msg}"):
+        logger.error(f"[{soc.id}] disconnected")
+        soc.close()
+        if soc.id in act and act[soc.id].sock is soc:
+            del act[soc.id]
 
     # send message to viewing clients also
     # -------------------------------------
     viewers.sendAll(f"info {msg}")
 
     # send to admin
-    for (who, v) in list(admin.items()):
-        soc = v.sock
-        if not soc.send(f"info {msg}"):
-            logger.error(f"admin[{who}] disconnected")
-            soc.close()
+    for soc in broadcast([v.sock for v in admin.values()], f"info {msg}"):
+        logger.error(f"admin[{soc.id}] disconnected")
+        soc.close()
+        for who in [w for w, v in admin.items() if v.sock is soc]:
             del admin[who]
 
 
@@ -506,6 +499,18 @@ def saveSgf(gid: int, game: Game, sc: Optional[str], err: str) -> None:
         err=err,
     )
 
+    header = sgfHeader(
+        game,
+        cfg.serverName,
+        cfg.level,
+        cfg.rule,
+        cfg.boardsize,
+        cfg.komi,
+        gid,
+        "?",
+        dte,
+    )
+
     dest_dir = os.path.join(
         cfg.htmlDir,
         cfg.sgfDir,
@@ -514,39 +519,18 @@ def saveSgf(gid: int, game: Game, sc: Optional[str], err: str) -> None:
         game.ctime.strftime("%d"),
     )
 
-    os.makedirs(dest_dir, exist_ok=True)  # make directory if it doesn't exist
-
-    if sc is None:
-        # Save ongoing game as binary format for ranged request.
-        lines = re.split("([^;]*;)", sgfString)
-        lines = [e for e in lines if len(e) > 0]
-        with open(f"{dest_dir}/{gid}.bin.tmp", "wb") as f:
-            for line in lines:
-                data = line.encode(ENCODING)
-                comp = zlib.compress(data)
-                if len(data) < len(comp):
-                    f.write(len(data).to_bytes(4, "little", signed=True))
-                    f.write(data)
-                else:
-                    f.write((-len(comp)).to_bytes(4, "little", signed=True))
-                    f.write(comp)
-        os.replace(f"{dest_dir}/{gid}.bin.tmp", f"{dest_dir}/{gid}.bin")
-
-    if cfg.compressSgf:
-        with gzip.open(f"{dest_dir}/{gid}.sgf.gz.tmp", "wb") as f:
-            f.write(sgfString.encode(ENCODING))
-        os.replace(f"{dest_dir}/{gid}.sgf.gz.tmp", f"{dest_dir}/{gid}.sgf.gz")
-        # Clean up
-        if sc is not None:
-            for file in [f"{dest_dir}/{gid}.bin", f"{dest_dir}/{gid}.sgf"]:
-                try:
-                    os.remove(file)
-                except OSError:
-                    pass
-    else:
-        with open(f"{dest_dir}/{gid}.sgf.tmp", "wb") as f:
-            f.write(sgfString.encode(ENCODING))
-        os.replace(f"{dest_dir}/{gid}.sgf.tmp", f"{dest_dir}/{gid}.sgf")
+    # the files are written by the sgf writer thread
+    sgfWriter.submit(
+        SgfSave(
+            gid,
+            dest_dir,
+            sgfString,
+            header,
+            tuple(game.sgfBody(cfg.boardsize)),
+            sc is not None,
+            cfg.compressSgf,
+        )
+    )
 
 
 def gameover(gid: int, sc: str, err: str) -> None:
@@ -578,7 +562,7 @@ def gameover(gid: int, sc: str, err: str) -> None:
     # ----------------------------------------------
     viewers.sendAll(f"gameover {gid} {sc} {wtu} {btu}")
 
-    viewers.sendObservers(gid, f"update {gid} {sc}")
+    viewers.sendObservers(gid, f"update {gid} {sc}", coalesce=False)
     viewers.removeObservers(gid)
 
     see, see2 = seeRecord(games[gid], sc, dte, tme)
@@ -625,34 +609,27 @@ def viewer_respond(sock: Client, data: str) -> None:
 
     if req == "observe":
         gid = int(param)
+        msg = viewerSetup(gid)
+        logger.info(f"sending to viewer: game {gid} {msg is not None}")
+        sock.send(msg or f"setup {gid} ?")
 
         if gid in games:
+            viewers.addObserver(gid, who)
 
-            game = games[gid]
-
-            w = f"{game.w}({game.white_rate})"
-            b = f"{game.b}({game.black_rate})"
-
-            logger.info(
-                f"sending to viewer: game {gid} - - {cfg.boardsize} {cfg.komi} {w} {b} {cfg.level} ..."
-            )
-
-            msg = f"setup {gid} - - {cfg.boardsize} {cfg.komi} {w} {b} {cfg.level} {joinMoves(game.moves)}"
-            sock.send(msg)
 
-            viewers.addObserver(gid, who)
-        else:
-            if dbrec:
-                rec = dbrec.execute(
-                    "SELECT dta FROM games WHERE gid = ?", (gid,)
-                ).fetchone()
-                if rec:
-                    dta = rec[0]
-                    sock.send(f"setup {gid} {dta}")
-                else:
-                    sock.send(f"setup {gid} ?")
-            else:
-                sock.send(f"setup {gid} ?")
+# the "setup" message of a game for viewers, None for an unknown game
+# -------------------------------------------------------------------
+def viewerSetup(gid: int) -> Optional[str]:
+    if gid in games:
+        game = games[gid]
+        w = f"{game.w}({game.white_rate})"
+        b = f"{game.b}({game.black_rate})"
+        return f"setup {gid} - - {cfg.boardsize} {cfg.komi} {w} {b} {cfg.level} {joinMoves(game.moves)}"
+    if dbrec:
+        rec = dbrec.execute("SELECT dta FROM games WHERE gid = ?", (gid,)).fetchone()
+        if rec:
+            return f"setup {gid} {rec[0]}"
+    return None
 
 
 def player_respond(sock: Client, data: str) -> None:
@@ -673,7 +650,8 @@ def player_respond(sock: Client, data: str) -> None:
     if data == "quit":
         return _handle_player_quit(sock, data)
 
-    logger.debug(f"handle '{user.msg_state}' '{data}'")
+    if sock.traceLevel:
+        logger.log(sock.traceLevel, f"handle '{user.msg_state}' '{data}'")
 
     if user.msg_state == "protocol":
         return _handle_player_protocol(sock, data)
@@ -709,6 +687,7 @@ def _handle_player_protocol(sock: Client, data: str) -> None:
     if msg[0:2] == "v1":
         del act[who]
         viewers.add(who, sock)
+        sock.setPolicy(VIEWER_POLICY, viewerSetup)
 
         # close down current handler, open a new handler
         # ----------------------------------------------
@@ -1038,6 +1017,7 @@ def _handle_player_genmove(sock: Client, data: str) -> None:
 
     mv = data.strip()
     analysis = None
+    comment = None
     if act[who].useAnalyze:
         # parse and validate analyze info
         tokens = mv.split(None, 1)
@@ -1047,6 +1027,7 @@ def _handle_player_genmove(sock: Client, data: str) -> None:
             try:
                 info = json.loads(tokens[1])
                 analysis = json.dumps(info, indent=None, separators=(",", ":"))
+                comment = analysisComment(info)
             except:
                 logger.info(f"Bad analysis from {who}, '{tokens[1]}'")
     over = ""
@@ -1080,9 +1061,9 @@ def _handle_player_genmove(sock: Client, data: str) -> None:
 
     def add_move(mv: str):
         if ctm & 1:
-            game.moves.append((mv, wrt, analysis))
+            game.add_move(mv, wrt, analysis, comment)
         else:
-            game.moves.append((mv, brt, analysis))
+            game.add_move(mv, brt, analysis, comment)
 
     if mv.lower() == "resign":
         err = 0
@@ -1177,7 +1158,8 @@ def admin_respond(sock: Client, data: str) -> None:
         del admin[who]
         return
 
-    logger.debug(f"handle '{user.msg_state}' '{data}'")
+    if sock.traceLevel:
+        logger.log(sock.traceLevel, f"handle '{user.msg_state}' '{data}'")
 
     if user.msg_state == "waiting":
         try:
@@ -1321,7 +1303,7 @@ def _admin_command_match(sock: Client, tokens: List[str]) -> None:
         try:
             id = int(tokens[5])
             moves = load_game_moves(id)
-            # -> Optional[List[Tuple[str, int, Optional[str]]]]:
+            # -> Optional[Sequence[Move]]:
         except:
             sock.send("bad game")
             return
@@ -1388,7 +1370,7 @@ def _admin_command_abort(sock: Client, tokens: List[str]) -> None:
     sock.send(f"aborted {gid} {game.w} {game.b}")
 
 
-def load_game_moves(gid: int) -> Optional[List[Tuple[str, int, Optional[str]]]]:
+def load_game_moves(gid: int) -> Optional[Sequence[Move]]:
     if gid in games:
         logger.info(f"Resume game. Use game on memory {gid}")
         game = games[gid]
@@ -1404,17 +1386,62 @@ def load_game_moves(gid: int) -> Optional[List[Tuple[str, int, Optional[str]]]]:
                 tokens = dta[7:]
                 tokens.pop()
                 logger.info(f"restart_moves {gid} length:{len(tokens)}")
-                moves: List[Tuple[str, int, Optional[str]]] = []
+                moves: List[Move] = []
                 for i in range(len(tokens) // 2):
                     m = tokens[i * 2 + 0]
                     t = int(tokens[i * 2 + 1])
-                    moves.append((m, t, None))
+                    moves.append(Move(m, t, None, None))
                 return moves
             else:
                 logger.info(f"Resume game. No game in dbrec games {gid}")
         return None
 
 
+# a unique and temporary name and an active record for a new connection
+# ----------------------------------------------------------------------
+def register_client(client: Client) -> None:
+    global sid
+
+    client.id = str(sid)
+    sid += 1
+    act[client.id] = ActiveUser(client, "protocol", 0, cfg.defaultRating, cfg.maxK)
+
+
+# hand a line to the viewer, admin or player handler
+# --------------------------------------------------
+def dispatch_line(client: Client, line: str) -> None:
+    who = client.id
+
+    if who in viewers.vact:
+        if client.traceLevel:
+            logger.log(client.traceLevel, f"handle viewer {who}: {line}")
+        viewer_respond(client, line)
+    elif is_admin(who):
+        if client.traceLevel:
+            logger.log(client.traceLevel, f"handle admin {who}: {line}")
+        admin_respond(client, line)
+    else:
+        if client.traceLevel:
+            logger.log(client.traceLevel, f"handle player {who}: {line}")
+        player_respond(client, line)
+
+
+def unregister_client(client: Client) -> None:
+    if client.id in act and act[client.id].sock is client:
+        del act[client.id]
+
+
+def protocol_connected(client: ProtocolClient) -> None:
+    logger.info(f"Connection from {client.address}")
+    register_client(client)
+    client.send("protocol genmove_analyze")
+
+
+def protocol_closed(client: ProtocolClient) -> None:
+    unregister_client(client)
+    logger.info(f"disconnected: {client.id}")
+
+
 async def accept_connection(
     reader: asyncio.StreamReader, writer: asyncio.StreamWriter
 ) -> None:
@@ -1423,18 +1450,9 @@ async def accept_connection(
 
     logger.info(f"Connection from {address}")
 
-    # def accept_connection(sock: socket.socket) -> Client:
-    global act
-    global sid
-
-    # create a default id till we get user name
-    # -----------------------------------------
-    who = str(sid)
-    sid += 1
-
-    client = Client(reader, writer, who)
-
-    act[who] = ActiveUser(client, "protocol", 0, cfg.defaultRating, cfg.maxK)
+    client = StreamClient(reader, writer, "")
+    register_client(client)
+    who = client.id
 
     readTask = asyncio.create_task(client.readTask())
     writeTask = asyncio.create_task(client.writeTask())
@@ -1453,7 +1471,7 @@ async def accept_connection(
     logger.info(f"disconnected: {who}")
 
 
-async def handle_client(client: Client) -> None:
+async def handle_client(client: StreamClient) -> None:
 
     who = client.id
 
@@ -1462,18 +1480,7 @@ async def handle_client(client: Client) -> None:
     try:
         while client.alive:
             line = await client.readLine()
-
-            logger.debug(f"got new line: {who}/{client.id} {line}")
-
-            if who in viewers.vact:
-                logger.debug(f"handle viewer {who}: {line}")
-                viewer_respond(client, line)
-            elif is_admin(client.id):
-                logger.debug(f"handle admin {who}: {line}")
-                admin_respond(client, line)
-            else:
-                logger.debug(f"handle player {who}: {line}")
-                player_respond(client, line)
+            dispatch_line(client, line)
     except asyncio.CancelledError:
         logger.debug(f"cancelled: {who}")
     except:
@@ -1481,8 +1488,7 @@ async def handle_client(client: Client) -> None:
         logger.error(traceback.format_exc())
         logger.error(traceback.format_stack())
 
-    if client.id in act and act[client.id].sock is client:
-        del act[client.id]
+    unregister_client(client)
 
 
 # --------------------------------------------------------
@@ -1642,6 +1648,8 @@ def schedule_games() -> None:
                 dbrec.commit()
                 dbrec.close()
 
+            sgfWriter.close()
+
             logger.info("KILL FILE FOUND - EXIT CGOS")
             sys.exit(0)
 
@@ -1712,7 +1720,7 @@ def init_game(
     bp: str,
     white_remaining_time: Optional[int] = None,
     black_remaining_time: Optional[int] = None,
-    moves: Optional[List[Tuple[str, int, Optional[str]]]] = None,
+    moves: Optional[Sequence[Move]] = None,
 ) -> int:
 
     if white_remaining_time is None:
@@ -1728,18 +1736,26 @@ def init_game(
     rule = Rule(cfg.koRule)
     gme[gid] = GoGame(cfg.boardsize, rule)
 
-    for mv, _, _ in moves:
-        err = gme[gid].make(mv)
-        if err < 0:
-            xerr = err * -1
-            logger.error(f"Bad game move {gid} {ERR_MSG[xerr]}")
-            return 0
+    index, err = gme[gid].replay(m.move for m in moves)
+    if err < 0:
+        xerr = err * -1
+        logger.error(f"Bad game move {gid} {ERR_MSG[xerr]} at {index}")
+        return 0
 
     wr = ratingOf[wp]
     br = ratingOf[bp]
 
     game = Game(
-        wp, bp, 0, white_remaining_time, black_remaining_time, wr, br, moves, ctme
+        wp,
+        bp,
+        0,
+        white_remaining_time,
+        black_remaining_time,
+        wr,
+        br,
+        moves,
+        ctme,
+        cfg.boardsize,
     )
     games[gid] = game
     act[wp].gid = gid
@@ -1927,6 +1943,9 @@ async def schedule_games_task() -> None:
 
             if n % 4 == 0:
                 infoMsg(f"Games in progress: {last_game_count} Players:{len(act)}")
+                logger.info(f"sgf writer {sgfWriter.stats()}")
+                logger.info(f"broadcast {broadcastStats.asdict()}")
+                broadcastStats.reset()
                 n = 0
             n += 1
         except Exception as e:
@@ -1941,7 +1960,15 @@ last_est = now_seconds()
 
 
 async def server_main() -> None:
-    server = await asyncio.start_server(accept_connection, "", cfg.portNumber)
+    if cfg.connectionMode == ConnectionMode.STREAM:
+        server = await asyncio.start_server(accept_connection, "", cfg.portNumber)
+    else:
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(
+            lambda: ProtocolClient(protocol_connected, dispatch_line, protocol_closed),
+            "",
+            cfg.portNumber,
+        )
 
     addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
     logger.info(f"Serving on {addrs}")
@@ -1962,6 +1989,7 @@ def runServer() -> None:
     global workdir
     global defaultRatingAverage
     global passctx
+    global sgfWriter
 
     # READ the configuration file
     # ---------------------------
@@ -1973,6 +2001,10 @@ def runServer() -> None:
         cfg.load(sys.argv[1])
         leeway = int(cfg.timeGift * 1000.0)
 
+        GoGame.repetitionLog = cfg.repetitionLog
+        GoGame.repetitionSampleRate = cfg.repetitionSampleRate
+        wireTrace.configure(cfg.wireTraceRate)
+
         defaultRatingAverage = cfg.defaultRating
 
         if cfg.hashPassword:
@@ -2002,4 +2034,6 @@ def runServer() -> None:
     initDatabase()
     openDatabase()
 
+    sgfWriter = SgfWriter(cfg.sgfQueueSize)
+
     asyncio.run(server_main())
@@ -22,51 +22,241 @@
 # THE SOFTWARE.
 
 import asyncio
+import time
 import traceback
-from typing import Optional
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
-from util.logutils import getLogger
+from util.logutils import WireTrace, getLogger
 
 
 # Setup logger
 logger = getLogger("cgos_server.client")
 
+# messages of traced connections
+wire = getLogger("cgos_server.wire")
+wireTrace = WireTrace(wire)
+
 ENCODING = "utf-8"
 
 MAX_QUEUE_SIZE = 10
 
+# longest line a client may send, the default StreamReader limit
+MAX_LINE = 64 * 1024
 
-class Client:
-    def __init__(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, id: str
-    ) -> None:
-        self._reader = reader
-        self._writer = writer
-        self._readQueue: asyncio.Queue[str] = asyncio.Queue(MAX_QUEUE_SIZE)
-        self._writeQueue: asyncio.Queue[str] = asyncio.Queue(MAX_QUEUE_SIZE)
+# bytes a viewer may have waiting before it is dropped
+MAX_WRITE_BUFFER = 1 << 20
+
+
+# messages as sent on the wire, one line each
+# -------------------------------------------
+def encodeLines(*messages: str) -> bytes:
+    return bytes("\n".join(messages) + "\n", encoding=ENCODING)
+
+
+# a client falls behind above "high" waiting bytes and catches up at
+# "low", coalescing game updates if "coalesce"; dropped above "limit"
+class OutboundPolicy:
+    high: int
+    low: int
+    limit: int
+    coalesce: bool
+
+    def __init__(self, high: int, low: int, limit: int, coalesce: bool) -> None:
+        self.high = high
+        self.low = low
+        self.limit = limit
+        self.coalesce = coalesce
+
+
+# players and administrators, every message is sent in order
+PLAYER_POLICY = OutboundPolicy(64 * 1024, 16 * 1024, 0, False)
+
+VIEWER_POLICY = OutboundPolicy(64 * 1024, 16 * 1024, MAX_WRITE_BUFFER, True)
+
+
+# a connection of a player, a viewer or an administrator
+class Client(ABC):
+    id: str
+    user_name: Optional[str]
+    alive: bool
+    policy: OutboundPolicy
+    resync: Optional[Callable[[int], Optional[str]]]  # "setup" message of a game
+    coalesced: int  # updates replaced by a resync
+    resyncs: int  # resync messages sent
+    lostResyncs: int  # resyncs without a message, the coalesced updates are lost
+    messages: int  # sendBytes calls
+    writes: int  # transport writes, each at most one send syscall
+    bytesSent: int
+    traceLevel: int  # level of the wire log, 0 if the connection is not traced
+
+    def __init__(self, id: str) -> None:
         self.id = id or "<unknown>"
-        self.user_name: Optional[str] = None
+        self.user_name = None
         self.alive = True
+        self.policy = PLAYER_POLICY
+        self.resync = None
+        self.coalesced = 0
+        self.resyncs = 0
+        self.lostResyncs = 0
+        self.messages = 0
+        self.writes = 0
+        self.bytesSent = 0
+        self.traceLevel = wireTrace.connectionLevel()
+        # (gid, message) held while behind, None while a resync is due
+        self._held: Optional[List[Tuple[int, Optional[bytes]]]] = None
+        self._heldBytes = 0
 
     def close(self) -> None:
         self.alive = False
 
+    def setPolicy(
+        self, policy: OutboundPolicy, resync: Optional[Callable[[int], Optional[str]]] = None
+    ) -> None:
+        self.policy = policy
+        self.resync = resync
+        if not policy.coalesce:
+            self._catchUp()
+
+    # send lines, False if the connection is gone
+    # -------------------------------------------
     def send(self, *messages: str) -> bool:
-        try:
-            logger.debug(f"S -> {self.id}: '{list(messages)}'")
-            if self._writer.is_closing():
-                logger.info(f"writer is closing user: {self.id}")
-                self.alive = False
-                return False
-            message = "\n".join(messages) + "\n"
-            self._writeQueue.put_nowait(message)
-            return True
-        except:
-            logger.error(f"alert: Client crash for user: {self.id}")
-            logger.error(traceback.format_exc())
-            logger.error(traceback.format_stack())
+        return self.sendBytes(encodeLines(*messages))
+
+    # send lines encoded by encodeLines, the same buffer may be handed to
+    # any number of clients.  "gid" marks an update of that game which a
+    # resync can replace
+    # -------------------------------------------------------------------
+    def sendBytes(self, data: bytes, gid: int = 0) -> bool:
+        self.messages += 1
+        if self.traceLevel:
+            wire.log(self.traceLevel, f"S -> {self.id}: {data!r}")
+        if not self._writable():
+            logger.info(f"writer is closing user: {self.id}")
+            self.alive = False
+            return False
+        if self._held is not None:
+            self._hold(data, gid)
+        elif not self._write(data):
+            self.alive = False
+            return False
+        limit = self.policy.limit
+        if limit > 0 and self._pending() + self._heldBytes > limit:
+            logger.info(f"too far behind {self.id} {self._pending()} {self._heldBytes}")
             self.alive = False
+            self._abort()
             return False
+        return True
+
+    def _hold(self, data: bytes, gid: int) -> None:
+        assert self._held is not None
+        if gid > 0 and self.resync is not None and any(g == gid for g, _ in self._held):
+            held = [(g, d) for g, d in self._held if g != gid]
+            self.coalesced += 1 + sum(1 for g, d in self._held if g == gid and d is not None)
+            self._held = held + [(gid, None)]
+            self._heldBytes = sum(len(d) for _, d in held if d is not None)
+        else:
+            self._held.append((gid, data))
+            self._heldBytes += len(data)
+
+    # more than policy.high bytes are waiting
+    # ---------------------------------------
+    def _fallBehind(self) -> None:
+        if self.policy.coalesce and self._held is None:
+            logger.info(f"falling behind {self.id}")
+            self._held = []
+
+    # waiting bytes are down to policy.low, send what was held.  A game
+    # without a resync message has ended and left no record, its final
+    # update and gameover are not coalesced and still follow
+    # -----------------------------------------------------------------
+    def _catchUp(self) -> None:
+        held = self._held
+        if held is None:
+            return
+        self._held = None
+        self._heldBytes = 0
+        for gid, data in held:
+            if data is None:
+                msg = self.resync(gid) if self.resync is not None else None
+                if msg is None:
+                    self.lostResyncs += 1
+                    logger.info(f"no resync for game {gid} {self.id}, its updates are lost")
+                    continue
+                data = encodeLines(msg)
+                self.resyncs += 1
+            if not self._write(data):
+                self.alive = False
+                return
+        logger.info(
+            f"caught up {self.id} coalesced:{self.coalesced} resyncs:{self.resyncs}"
+            f" lost:{self.lostResyncs}"
+        )
+
+    def counters(self) -> str:
+        return f"messages:{self.messages} writes:{self.writes} bytes:{self.bytesSent}"
+
+    @abstractmethod
+    def _writable(self) -> bool:
+        ...
+
+    # pass data on to the connection
+    # ------------------------------
+    @abstractmethod
+    def _write(self, data: bytes) -> bool:
+        ...
+
+    # bytes not sent yet
+    # ------------------
+    @abstractmethod
+    def _pending(self) -> int:
+        ...
+
+    @abstractmethod
+    def _abort(self) -> None:
+        ...
+
+
+# client on asyncio streams, served by readTask, writeTask and readLine
+class StreamClient(Client):
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, id: str
+    ) -> None:
+        super().__init__(id)
+        self._reader = reader
+        self._writer = writer
+        self._readQueue: asyncio.Queue[str] = asyncio.Queue(MAX_QUEUE_SIZE)
+        self._writeQueue: asyncio.Queue[bytes] = asyncio.Queue()
+        self._queued = 0  # bytes in _writeQueue
+        # drain() waits until the transport is down to policy.low
+        writer.transport.set_write_buffer_limits(self.policy.high, self.policy.low)
+
+    def setPolicy(
+        self, policy: OutboundPolicy, resync: Optional[Callable[[int], Optional[str]]] = None
+    ) -> None:
+        super().setPolicy(policy, resync)
+        self._writer.transport.set_write_buffer_limits(policy.high, policy.low)
+
+    def _writable(self) -> bool:
+        return not self._writer.is_closing()
+
+    # the bytes waiting in the transport count, a slow socket is behind
+    # even when writeTask keeps the queue empty.  writeTask catches up
+    # on the queue alone: the transport is drained to policy.low or is
+    # below policy.high by then, and nothing else would wake it up
+    # -----------------------------------------------------------------
+    def _write(self, data: bytes) -> bool:
+        self._writeQueue.put_nowait(data)
+        self._queued += len(data)
+        if self._pending() > self.policy.high:
+            self._fallBehind()
+        return True
+
+    def _pending(self) -> int:
+        return self._queued + self._writer.transport.get_write_buffer_size()
+
+    def _abort(self) -> None:
+        self._writer.transport.abort()
 
     def readLine_nowait(self) -> Optional[str]:
         try:
@@ -75,26 +265,41 @@ class Client:
             return None
 
     async def readLine(self) -> str:
-        line = await self._readQueue.get()
-        logger.debug(f"S <- {self.id}: '{line}'")
-        return line
+        return await self._readQueue.get()
 
+    # write everything queued at once, and wait for the socket only
+    # when the transport holds more than policy.high bytes
+    # --------------------------------------------------------------
     async def writeTask(self) -> None:
         while self.alive:
             try:
-                msg = await self._writeQueue.get()
-                logger.debug(f"S ==> {self.id}: '{msg}'")
-                self._writer.write(bytes(msg, encoding=ENCODING))
-                await self._writer.drain()
+                chunks = [await self._writeQueue.get()]
+                while not self._writeQueue.empty():
+                    chunks.append(self._writeQueue.get_nowait())
+                n = sum(map(len, chunks))
+                if n == 0:
+                    # woken up by readTask
+                    continue
+                if self.traceLevel:
+                    wire.log(self.traceLevel, f"S ==> {self.id}: {len(chunks)} {n}")
+                self._queued -= n
+                self._writer.writelines(chunks)
+                self.writes += 1
+                self.bytesSent += n
+                if self._writer.transport.get_write_buffer_size() > self.policy.high:
+                    await self._writer.drain()
+                elif self._writer.is_closing():
+                    raise ConnectionResetError("connection closed")
+                if self._queued <= self.policy.low:
+                    self._catchUp()
             except Exception as e:
                 logger.info(f"writer exception {self.id} {str(e)}")
                 self.alive = False
-            logger.debug(f"send queue {self.id}: {self._writeQueue.qsize()} {msg}")
         try:
             self._writer.close()
         except:
             pass
-        logger.info(f"writer ended {self.id}")
+        logger.info(f"writer ended {self.id} {self.counters()}")
 
     async def readTask(self) -> None:
         # Old python client doesn't send new line
@@ -115,14 +320,202 @@ class Client:
                 if len(line) == 0:
                     self.alive = False
                     break
-                logger.debug(f"S <== {self.id}: '{str(line, ENCODING)}'")
-                await self._readQueue.put(str(line, encoding=ENCODING))
+                text = str(line, encoding=ENCODING)
+                if self.traceLevel:
+                    wire.log(self.traceLevel, f"S <== {self.id}: '{text}'")
+                await self._readQueue.put(text)
             except Exception as e:
                 logger.info(f"reader exception {self.id} {str(e)}")
                 self.alive = False
         try:
             # put empty string to run writer queue
-            self._writeQueue.put_nowait("")
+            self._writeQueue.put_nowait(b"")
         except:
             pass
         logger.info(f"reader ended {self.id}")
+
+
+# client on an asyncio transport, lines are handled in data_received
+# and messages written to the transport, no task per connection
+class ProtocolClient(Client, asyncio.Protocol):
+    def __init__(
+        self,
+        connected: Callable[["ProtocolClient"], None],
+        received: Callable[["ProtocolClient", str], None],
+        closed: Callable[["ProtocolClient"], None],
+    ) -> None:
+        Client.__init__(self, "")
+        self._connected = connected
+        self._received = received
+        self._closed = closed
+        self._transport: Optional[asyncio.WriteTransport] = None
+        self._corked: Optional[List[bytes]] = None  # written at the end of the loop iteration
+        self._corkedBytes = 0
+        self._buffer = bytearray()
+        self._first = True
+        self._pythonClient = False
+        self.address = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.WriteTransport)
+        self._transport = transport
+        transport.set_write_buffer_limits(self.policy.high, self.policy.low)
+        self.address = transport.get_extra_info("peername")
+        self._connected(self)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if exc is not None:
+            logger.info(f"connection lost {self.id} {str(exc)}")
+        self.alive = False
+        self._corked = None
+        self._closed(self)
+        logger.info(f"connection ended {self.id} {self.counters()}")
+
+    def data_received(self, data: bytes) -> None:
+        if self._first:
+            # Old python client doesn't send new line
+            self._first = False
+            self._pythonClient = data.find(b"\n") < 0
+            logger.info(f"Client {self.id} old-python-client:{self._pythonClient} {len(data)}")
+        if self._pythonClient:
+            self._receive(str(data, encoding=ENCODING))
+            return
+        self._buffer += data
+        start = 0
+        while self.alive:
+            end = self._buffer.find(b"\n", start)
+            if end < 0:
+                break
+            self._receive(self._buffer[start:end + 1].decode(ENCODING))
+            start = end + 1
+        del self._buffer[:start]
+        if len(self._buffer) > MAX_LINE and self.alive:
+            logger.info(f"line too long {self.id} {len(self._buffer)}")
+            self._buffer.clear()
+            self.close()
+
+    def _receive(self, line: str) -> None:
+        if not self.alive:
+            return
+        if self.traceLevel:
+            wire.log(self.traceLevel, f"S <== {self.id}: '{line}'")
+        try:
+            self._received(self, line)
+        except:
+            logger.error(f"Unexpected Error: {self.id}")
+            logger.error(traceback.format_exc())
+            self.close()
+
+    def close(self) -> None:
+        self.alive = False
+        if self._transport is not None:
+            # buffered messages are sent before the socket is closed
+            self._uncork()
+            self._transport.close()
+
+    def setPolicy(
+        self, policy: OutboundPolicy, resync: Optional[Callable[[int], Optional[str]]] = None
+    ) -> None:
+        super().setPolicy(policy, resync)
+        if self._transport is not None:
+            self._transport.set_write_buffer_limits(policy.high, policy.low)
+
+    # the transport buffer is above policy.high
+    # -----------------------------------------
+    def pause_writing(self) -> None:
+        self._fallBehind()
+
+    def resume_writing(self) -> None:
+        self._catchUp()
+
+    def _writable(self) -> bool:
+        return self._transport is not None and not self._transport.is_closing()
+
+    # messages sent while handling one event are written together once
+    # the loop gets to the callbacks
+    # -----------------------------------------------------------------
+    def _write(self, data: bytes) -> bool:
+        if self._corked is None:
+            self._corked = []
+            asyncio.get_running_loop().call_soon(self._uncork)
+        self._corked.append(data)
+        self._corkedBytes += len(data)
+        return True
+
+    def _uncork(self) -> None:
+        chunks = self._corked
+        n = self._corkedBytes
+        self._corked = None
+        self._corkedBytes = 0
+        if not chunks or self._transport is None or self._transport.is_closing():
+            return
+        try:
+            self._transport.writelines(chunks)
+            self.writes += 1
+            self.bytesSent += n
+        except:
+            logger.error(f"alert: Client crash for user: {self.id}")
+            logger.error(traceback.format_exc())
+            self.alive = False
+
+    def _pending(self) -> int:
+        assert self._transport is not None
+        return self._corkedBytes + self._transport.get_write_buffer_size()
+
+    def _abort(self) -> None:
+        assert self._transport is not None
+        self._transport.abort()
+
+
+# fan-out of broadcast messages
+class BroadcastStats:
+    broadcasts: int
+    recipients: int
+    bytes: int  # bytes encoded, once per broadcast
+    seconds: float  # time spent handing messages to clients
+    maxSeconds: float
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.broadcasts = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.maxSeconds = 0.0
+
+    def asdict(self) -> Dict[str, Union[int, float]]:
+        n = max(1, self.broadcasts)
+        return {
+            "broadcasts": self.broadcasts,
+            "recipients": self.recipients,
+            "bytes": self.bytes,
+            "meanFanoutMs": 1000.0 * self.seconds / n,
+            "maxFanoutMs": 1000.0 * self.maxSeconds,
+        }
+
+
+broadcastStats = BroadcastStats()
+
+
+# send a message to many clients, encoded once, "gid" as in sendBytes
+# return the clients which are gone
+# -------------------------------------------------------------------
+def broadcast(clients: Iterable[Client], *messages: str, gid: int = 0) -> List[Client]:
+    start = time.perf_counter()
+    data = encodeLines(*messages)
+    gone = []
+    n = 0
+    for client in clients:
+        n += 1
+        if not client.sendBytes(data, gid) or not client.alive:
+            gone.append(client)
+    elapsed = time.perf_counter() - start
+
+    broadcastStats.broadcasts += 1
+    broadcastStats.recipients += n
+    broadcastStats.bytes += len(data)
+    broadcastStats.seconds += elapsed
+    broadcastStats.maxSeconds = max(broadcastStats.maxSeconds, elapsed)
+    return gone
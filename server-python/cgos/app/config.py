@@ -27,7 +27,7 @@ from enum import Enum
 from typing import Optional
 
 from util.logutils import getLogger
-from gogame import KoRule
+from gogame import KoRule, RepetitionLog
 
 
 # Setup logger
@@ -39,12 +39,19 @@ class MatchMode(Enum):
     ADMIN = 1
 
 
+class ConnectionMode(Enum):
+    STREAM = 0  # asyncio streams, three tasks per connection
+    PROTOCOL = 1  # asyncio.Protocol, no task per connection
+
+
 class Configs:
     serverName: str
     rule: str
     boardsize: int
     komi: float
     koRule: KoRule
+    repetitionLog: RepetitionLog
+    repetitionSampleRate: float
     level: int
     portNumber: int
     timeGift: float
@@ -67,8 +74,11 @@ class Configs:
     anchor_match_rate: float
     badUsersFile: str
     moveIntervalBetweenSave: int
+    sgfQueueSize: int
     hashPassword: bool
     matchMode: MatchMode
+    connectionMode: ConnectionMode
+    wireTraceRate: float
 
     def load(self, path: str) -> None:
         config = configparser.ConfigParser()
@@ -94,6 +104,15 @@ class Configs:
         else:
             self.koRule = KoRule.POSITIONAL
 
+        self.repetitionLog = RepetitionLog.OFF
+        if "repetitionLog" in cfg:
+            try:
+                self.repetitionLog = RepetitionLog[cfg["repetitionLog"]]
+            except:
+                logger.error(f"Bad repetition log mode {cfg['repetitionLog']}")
+                sys.exit(1)
+        self.repetitionSampleRate = float(cfg.get("repetitionSampleRate", "0.01"))
+
         self.level = int(cfg["level"]) * 1000
         self.timeGift = float(cfg["timeGift"])
         self.database_state_file = str(cfg["database_state_file"])
@@ -120,6 +139,7 @@ class Configs:
         self.anchor_match_rate = float(cfg.get("anchor_match_rate", "0.10"))
         self.badUsersFile = str(cfg["bad_users_file"])
         self.moveIntervalBetweenSave = int(cfg["moveIntervalBetweenSave"])
+        self.sgfQueueSize = int(cfg.get("sgfQueueSize", "1000"))
         if "hashPassword" in cfg:
             self.hashPassword = cfg.getboolean("hashPassword")
         else:
@@ -133,3 +153,12 @@ class Configs:
                 logger.error(f"Bad match mode {cfg['matchMode']}")
                 sys.exit(1)
         logger.info(f"Match mode {self.matchMode}")
+
+        self.connectionMode = ConnectionMode.STREAM
+        if "connectionMode" in cfg:
+            try:
+                self.connectionMode = ConnectionMode[cfg["connectionMode"]]
+            except:
+                logger.error(f"Bad connection mode {cfg['connectionMode']}")
+                sys.exit(1)
+        self.wireTraceRate = float(cfg.get("wireTraceRate", "0.0"))
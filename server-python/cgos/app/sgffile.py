@@ -0,0 +1,361 @@
+# The MIT License
+#
+# Copyright (C) 2009 Don Dailey and Jason House
+# Copyright (c) 2022 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Append-only record file of an ongoing game, {gid}.bin
+#
+#   header   "CGSB", version (uint8), dictionary (uint8), 2 reserved bytes
+#   record   int32 length, then the payload; a negative length means
+#            the payload is compressed
+#
+# The first record is the SGF root node, each further record is the
+# SGF node of one move, so a viewer concatenates the payloads and
+# closes the tree with ")".  Records are never rewritten: a viewer
+# remembers where the last complete record ended and fetches the rest
+# with an HTTP range request.  {gid}.idx holds the uint32 offset of
+# every record, for viewers which want to jump to a move.
+#
+# Dictionary 0 compresses every record as a zlib stream of its own.
+# Other dictionaries are raw deflate streams with a preset dictionary
+# of SGF and genmove_analyze text, so that short nodes compress too.
+# The viewer (wgo_view/cgos_viewer/viewer.js) keeps a copy of every
+# dictionary; a dictionary is never changed once released, a new one
+# gets the next number.
+
+import gzip
+import os
+import struct
+import threading
+import time
+import traceback
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from util.logutils import getLogger
+
+logger = getLogger("cgos_server.sgffile")
+
+ENCODING = "utf-8"
+
+BIN_HEADER = struct.Struct("<4sBB2x")
+BIN_MAGIC = b"CGSB"
+BIN_VERSION = 2
+
+RECORD_LENGTH = struct.Struct("<i")
+INDEX_OFFSET = struct.Struct("<I")
+
+# Preset dictionaries by number.  Strings which are found more often go
+# last, deflate reaches them with shorter distances.
+ZDICTS: Dict[int, bytes] = {
+    1: (
+        "(;GM[1]FF[4]CA[UTF-8]\nRU[Chinese]SZ[19]KM[7.5]TM[900]\nPW[PB[WR[BR[DT[PC[RE[?         ]GN["
+        '"scoreStdev":"lcb":"utility":"scoreMean":"custom":{'
+        '"ownership":"AAAAAAAAAAAAAAAAAAA999999999999999999"'
+        '"visits":"winrate":0.5"score":0.'
+        ";C[Q16 D4 Q4 D16 R16 C4 R4 C16 Q3 D17 R17 C3 "
+        '"order":0,"prior":0.0'
+        '},{"move":"'
+        '"pv":"D4 Q16 Q4 D16 '
+        ';B[]BL[;W[]WL['
+        ']\nCC[{"moves":[{"move":"'
+        "]WL[8]BL[8;W[;B["
+    ).encode(ENCODING),
+}
+ZDICT = 1  # dictionary of new record files
+
+
+# length prefixed, compressed when that is smaller
+# ------------------------------------------------
+def encodeRecord(chunk: str, dictionary: int = 0) -> bytes:
+    data = chunk.encode(ENCODING)
+    if dictionary == 0:
+        comp = zlib.compress(data)
+    else:
+        c = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICTS[dictionary])
+        comp = c.compress(data) + c.flush()
+    if len(data) < len(comp):
+        return RECORD_LENGTH.pack(len(data)) + data
+    return RECORD_LENGTH.pack(-len(comp)) + comp
+
+
+# payloads of the complete records of a .bin file
+# -----------------------------------------------
+def decodeRecords(data: bytes) -> List[str]:
+    magic, version, dictionary = BIN_HEADER.unpack_from(data)
+    if magic != BIN_MAGIC or version != BIN_VERSION:
+        raise ValueError(f"not a record file {magic!r} version {version}")
+    if dictionary != 0 and dictionary not in ZDICTS:
+        raise ValueError(f"unknown dictionary {dictionary}")
+    ret = []
+    pos = BIN_HEADER.size
+    while pos + RECORD_LENGTH.size <= len(data):
+        (size,) = RECORD_LENGTH.unpack_from(data, pos)
+        end = pos + RECORD_LENGTH.size + abs(size)
+        if end > len(data):
+            break
+        payload = data[pos + RECORD_LENGTH.size:end]
+        if size < 0:
+            if dictionary == 0:
+                payload = zlib.decompress(payload)
+            else:
+                d = zlib.decompressobj(-15, zdict=ZDICTS[dictionary])
+                payload = d.decompress(payload) + d.flush()
+        ret.append(payload.decode(ENCODING))
+        pos = end
+    return ret
+
+
+# writer of the record file of one ongoing game
+class LiveSgf:
+    path: str
+    indexPath: str
+    dictionary: int
+    size: int  # bytes written to the record file
+    records: int  # records written, the entries of the index file
+    nodes: int  # move nodes written
+
+    def __init__(self, path: str, header: str, dictionary: int = ZDICT) -> None:
+        self.path = path
+        self.indexPath = os.path.splitext(path)[0] + ".idx"
+        self.dictionary = dictionary
+        self.nodes = 0
+        with open(self.path, "wb") as f:
+            f.write(BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, dictionary))
+        with open(self.indexPath, "wb"):
+            pass
+        self.size = BIN_HEADER.size
+        self.records = 0
+        self.append([header])
+
+    # append one record per chunk.  Both files are written at the end
+    # of what was written before, so the bytes of a failed write are
+    # overwritten by the next one
+    # ----------------------------------------------------------------
+    def append(self, chunks: List[str]) -> None:
+        if len(chunks) == 0:
+            return
+        records = [encodeRecord(c, self.dictionary) for c in chunks]
+        offsets = []
+        size = self.size
+        for r in records:
+            offsets.append(INDEX_OFFSET.pack(size))
+            size += len(r)
+        with open(self.path, "r+b") as f:
+            f.seek(self.size)
+            f.write(b"".join(records))
+            f.truncate()
+        with open(self.indexPath, "r+b") as f:
+            f.seek(self.records * INDEX_OFFSET.size)
+            f.write(b"".join(offsets))
+            f.truncate()
+        self.size = size
+        self.records += len(records)
+
+    # append the move nodes which are not written yet
+    # -----------------------------------------------
+    def appendNodes(self, nodes: List[str]) -> None:
+        self.append(nodes[self.nodes:])
+        self.nodes = len(nodes)
+
+    # remove the record and index files
+    # ---------------------------------
+    def remove(self) -> None:
+        for path in [self.path, self.indexPath]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# the files of one game to write, taken on the event loop
+class SgfSave:
+    gid: int
+    destDir: str
+    sgf: str  # the whole record
+    header: str  # SGF root node, for a new record file
+    nodes: Tuple[str, ...]  # SGF nodes of the moves
+    final: bool  # the game is over
+    compress: bool
+
+    def __init__(
+        self,
+        gid: int,
+        destDir: str,
+        sgf: str,
+        header: str,
+        nodes: Tuple[str, ...],
+        final: bool,
+        compress: bool,
+    ) -> None:
+        self.gid = gid
+        self.destDir = destDir
+        self.sgf = sgf
+        self.header = header
+        self.nodes = nodes
+        self.final = final
+        self.compress = compress
+
+
+# write the .sgf or .sgf.gz file and the record file of an ongoing game
+# ---------------------------------------------------------------------
+def writeSgf(save: SgfSave, liveSgf: Dict[int, LiveSgf]) -> None:
+    gid = save.gid
+    dest_dir = save.destDir
+    os.makedirs(dest_dir, exist_ok=True)  # make directory if it doesn't exist
+
+    if not save.final:
+        # Append the new moves of the ongoing game for ranged requests.
+        live = liveSgf.get(gid)
+        if live is None:
+            live = LiveSgf(f"{dest_dir}/{gid}.bin", save.header)
+            liveSgf[gid] = live
+        live.appendNodes(list(save.nodes))
+    else:
+        liveSgf.pop(gid, None)
+        for file in [f"{dest_dir}/{gid}.bin", f"{dest_dir}/{gid}.idx"]:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+    if save.compress:
+        with gzip.open(f"{dest_dir}/{gid}.sgf.gz.tmp", "wb") as f:
+            f.write(save.sgf.encode(ENCODING))
+        os.replace(f"{dest_dir}/{gid}.sgf.gz.tmp", f"{dest_dir}/{gid}.sgf.gz")
+        # Clean up
+        if save.final:
+            try:
+                os.remove(f"{dest_dir}/{gid}.sgf")
+            except OSError:
+                pass
+    else:
+        with open(f"{dest_dir}/{gid}.sgf.tmp", "wb") as f:
+            f.write(save.sgf.encode(ENCODING))
+        os.replace(f"{dest_dir}/{gid}.sgf.tmp", f"{dest_dir}/{gid}.sgf")
+
+
+# thread writing the SGF files in submit order, a waiting save is
+# replaced by a newer one of its game; submit never blocks
+class SgfWriter:
+    maxsize: int
+    liveSgf: Dict[int, LiveSgf]  # record files of the ongoing games
+    submitted: int
+    written: int
+    coalesced: int  # saves replaced by a newer save of the same game
+    dropped: int  # saves of ongoing games dropped while the queue was full
+    errors: int
+    maxDepth: int
+    writeSeconds: float  # total time spent writing
+    maxWriteSeconds: float
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.liveSgf = dict()
+        self.submitted = 0
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+        self.maxDepth = 0
+        self.writeSeconds = 0.0
+        self.maxWriteSeconds = 0.0
+        self._pending: Dict[int, SgfSave] = dict()
+        self._cond = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sgf-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, save: SgfSave) -> None:
+        with self._cond:
+            self.submitted += 1
+            if save.gid in self._pending:
+                self._pending[save.gid] = save
+                self.coalesced += 1
+                return
+            if len(self._pending) >= self.maxsize and not save.final:
+                self.dropped += 1
+                logger.info(f"sgf queue full, save of game {save.gid} dropped")
+                return
+            self._pending[save.gid] = save
+            self.maxDepth = max(self.maxDepth, len(self._pending))
+            self._cond.notify_all()
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    # wait until every submitted save is written
+    # ------------------------------------------
+    def flush(self) -> None:
+        with self._cond:
+            while len(self._pending) > 0 or self._busy:
+                self._cond.wait()
+
+    # write the pending saves and stop the thread
+    # -------------------------------------------
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self) -> str:
+        with self._cond:
+            depth = len(self._pending)
+        avg = self.writeSeconds / self.written * 1000.0 if self.written > 0 else 0.0
+        return (
+            f"depth:{depth} max_depth:{self.maxDepth} submitted:{self.submitted}"
+            f" written:{self.written} coalesced:{self.coalesced} dropped:{self.dropped}"
+            f" errors:{self.errors} write_avg:{avg:.2f}ms"
+            f" write_max:{self.maxWriteSeconds * 1000.0:.2f}ms"
+        )
+
+    def _next(self) -> Optional[SgfSave]:
+        with self._cond:
+            self._busy = False
+            self._cond.notify_all()
+            while len(self._pending) == 0:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            gid = next(iter(self._pending))
+            self._busy = True
+            self._cond.notify_all()
+            return self._pending.pop(gid)
+
+    def _run(self) -> None:
+        while True:
+            save = self._next()
+            if save is None:
+                return
+            start = time.perf_counter()
+            try:
+                writeSgf(save, self.liveSgf)
+            except Exception:
+                self.errors += 1
+                logger.error(f"Error while writing sgf of game {save.gid}")
+                logger.error(traceback.format_exc())
+            elapsed = time.perf_counter() - start
+            self.written += 1
+            self.writeSeconds += elapsed
+            self.maxWriteSeconds = max(self.maxWriteSeconds, elapsed)
@@ -0,0 +1,172 @@
+# The MIT License
+#
+# Copyright (C) 2009 Don Dailey and Jason House
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Re-check the game archive.
+#
+#   PYTHONPATH=./cgos python3 cgos/audit_archive.py cgos19.ini [options]
+#
+# Every game of the game archive database is replayed with GoGame.
+# Games which ended by two passes are scored again and compared with
+# the stored result.  Workers read the archive themselves by rowid
+# range, so only the findings travel between processes.
+
+import argparse
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+from app.config import Configs
+from gogame import ERR_MSG, GoGame, KoRule, Rule
+
+koRule: KoRule = KoRule.POSITIONAL
+archive: Optional[sqlite3.Connection] = None
+
+
+# the result the server would store for a finished game
+# -----------------------------------------------------
+def score_result(game: GoGame, komi: float) -> str:
+    sc = game.ttScore() - komi
+    if sc < 0.0:
+        return f"W+{-sc}"
+    elif sc > 0.0:
+        return f"B+{sc}"
+    return "Draw"
+
+
+# is the result decided by counting?
+# ----------------------------------
+def is_score_result(res: str) -> bool:
+    if res == "Draw":
+        return True
+    try:
+        float(res[2:])
+    except ValueError:
+        return False
+    return res[:2] in ("W+", "B+")
+
+
+#  check_record - replay one archive record "dta"
+#
+#   dte tme boardsize komi white(rating) black(rating) level
+#   move time ... result
+#
+#   Return: None if the record is consistent, a description otherwise
+#   -----------------------------------------------------------------
+def check_record(dta: str, rule: Rule) -> Optional[str]:
+    tokens = dta.split()
+    if len(tokens) < 8 or len(tokens) % 2 != 0:
+        return "malformed record"
+    try:
+        size = int(tokens[2])
+        komi = float(tokens[3])
+    except ValueError:
+        return "malformed record"
+    moves = tokens[7:-1:2]
+    res = tokens[-1]
+    if len(moves) > 0 and moves[-1].lower() == "resign":
+        moves.pop()
+
+    game = GoGame(size, rule)
+    index, err = game.replay(moves)
+    if err < 0:
+        return f"illegal move {index + 1} {moves[index]}: {ERR_MSG[-err]}"
+
+    if is_score_result(res):
+        if not game.twopass():
+            return f"scored {res} without two passes"
+        expected = score_result(game, komi)
+        if expected != res:
+            return f"result {res} but the score is {expected}"
+    return None
+
+
+def init_worker(path: str, rule: KoRule) -> None:
+    global archive, koRule
+    archive = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    koRule = rule
+
+
+# check the games with rowid in [first, last)
+# -------------------------------------------
+def check_range(first: int, last: int) -> Tuple[int, List[Tuple[int, str]]]:
+    assert archive is not None
+    rule = Rule(koRule)
+    count = 0
+    bad = []
+    for gid, dta in archive.execute(
+        "SELECT gid, dta FROM games WHERE rowid >= ? AND rowid < ?", (first, last)
+    ):
+        count += 1
+        msg = check_record(dta, rule)
+        if msg is not None:
+            bad.append((gid, msg))
+    return count, bad
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="replay and re-score the game archive")
+    parser.add_argument("config", help="server configuration file")
+    parser.add_argument("--database", help="archive database, default from the configuration")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    parser.add_argument("--chunk", type=int, default=10000, help="games per task")
+    args = parser.parse_args()
+
+    cfg = Configs()
+    cfg.load(args.config)
+    path = args.database or cfg.game_archive_database
+    if path is None:
+        print("no game_archive_database in the configuration", file=sys.stderr)
+        sys.exit(1)
+
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    lo, hi = db.execute("SELECT min(rowid), max(rowid) FROM games").fetchone()
+    db.close()
+    if lo is None:
+        print("no games")
+        return
+
+    total = 0
+    mismatches = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=init_worker, initargs=(path, cfg.koRule)
+    ) as pool:
+        tasks = [
+            pool.submit(check_range, first, first + args.chunk)
+            for first in range(lo, hi + 1, args.chunk)
+        ]
+        for task in as_completed(tasks):
+            count, bad = task.result()
+            total += count
+            mismatches += len(bad)
+            for gid, msg in bad:
+                print(f"{gid} {msg}")
+            print(f"checked {total} games, {mismatches} mismatches", file=sys.stderr)
+
+    print(f"{total} games, {mismatches} mismatches")
+    if mismatches > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,24 @@
-from .go import GoGame, KoRule, Rule
-from .game import Game, sgf
+from .board import Board, Geometry, geometry
+from .go import ERR_MSG, GoGame, KoRule, RepetitionLog, Rule
+from .game import Game, sgf, sgfHeader
+from .moves import Move, MoveList, analysisComment
+from .score import AreaScore, score_area
 
-__all__ = ["GoGame", "Game", "KoRule", "Rule", "sgf"]
+__all__ = [
+    "ERR_MSG",
+    "AreaScore",
+    "Board",
+    "GoGame",
+    "Game",
+    "Geometry",
+    "KoRule",
+    "Move",
+    "MoveList",
+    "RepetitionLog",
+    "Rule",
+    "analysisComment",
+    "geometry",
+    "score_area",
+    "sgf",
+    "sgfHeader",
+]
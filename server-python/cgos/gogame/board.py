@@ -0,0 +1,391 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import random
+from typing import Dict, List, Tuple
+
+
+# Fixed seed so that position hashes are stable between server runs
+ZOBRIST_SEED = 0x6367_6F73
+
+_zobrist_tables: Dict[int, List[List[int]]] = dict()
+
+
+# zobrist keys for a bordered board of the given size
+# indexed as table[color][point], color 0 (empty) is all zero
+# -----------------------------------------------------------
+def zobrist_table(size: int) -> List[List[int]]:
+    table = _zobrist_tables.get(size)
+    if table is None:
+        rng = random.Random(ZOBRIST_SEED + size)
+        points = (size + 2) * (size + 1)
+        table = [[0] * points]
+        for _ in range(2):
+            table.append([rng.getrandbits(64) for _ in range(points)])
+        _zobrist_tables[size] = table
+    return table
+
+
+LEGAL_COORDINATES = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+
+
+# GTP vertex lookup tables for one board size
+class Vertices:
+    index: Dict[str, int]  # upper and lower case vertex or pass -> point
+    vertex: List[str]  # point -> upper case vertex, "PASS" for point 0
+    sgf: Dict[str, str]  # lower case vertex -> SGF point
+    sgfPoint: List[str]  # point -> SGF point, "" for pass and the border
+    sgfPointsOf: Dict[int, List[str]]  # other size -> its points as SGF points here
+
+    def __init__(self, size: int) -> None:
+        size1 = size + 1
+        self.index = {"PASS": 0, "pass": 0, "Pass": 0}
+        self.vertex = [""] * ((size + 2) * size1)
+        self.vertex[0] = "PASS"
+        self.sgf = dict()
+        self.sgfPoint = [""] * len(self.vertex)
+        self.sgfPointsOf = {size: self.sgfPoint}
+        for y in range(1, size + 1):
+            for x in range(1, size + 1):
+                ix = y * size1 + x
+                v = f"{LEGAL_COORDINATES[x - 1]}{size1 - y}"
+                self.index[v] = ix
+                self.index[v.lower()] = ix
+                self.vertex[ix] = v
+                self.sgf[v.lower()] = f"{chr(96 + x)}{chr(96 + y)}"
+                self.sgfPoint[ix] = self.sgf[v.lower()]
+
+    # the SGF points on this board of the points of a board of "size",
+    # "" when the vertex does not exist here
+    # ---------------------------------------------------------------
+    def sgfPoints(self, size: int) -> List[str]:
+        table = self.sgfPointsOf.get(size)
+        if table is None:
+            table = [self.sgf.get(v.lower(), "") for v in vertex_table(size).vertex]
+            self.sgfPointsOf[size] = table
+        return table
+
+
+# layout of a bordered board of one size, shared by all boards
+class Geometry:
+    size: int
+    size1: int
+    dir: List[int]  # the 4 possible directions
+    rows: List[int]  # index of the first point of each row
+    points: List[int]  # index of every on-board point, row by row
+    template: bytes  # the empty bordered board
+    zobrist: List[List[int]]
+    vertices: Vertices
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.size1 = size + 1
+        self.dir = [-1, 1, self.size1, -1 * self.size1]
+        self.rows = [y * self.size1 + 1 for y in range(1, size + 1)]
+        self.points = [r + x for r in self.rows for x in range(size)]
+
+        template = bytearray([3]) * ((size + 2) * self.size1)
+        for r in self.rows:
+            template[r:r + size] = bytes(size)
+        self.template = bytes(template)
+
+        self.zobrist = zobrist_table(size)
+        self.vertices = Vertices(size)
+
+
+_geometries: Dict[int, Geometry] = dict()
+
+
+# geometry of the given size, built once and shared by all games
+# --------------------------------------------------------------
+def geometry(size: int) -> Geometry:
+    g = _geometries.get(size)
+    if g is None:
+        g = Geometry(size)
+        _geometries[size] = g
+    return g
+
+
+# vertex tables of the given size, shared by all games
+# ----------------------------------------------------
+def vertex_table(size: int) -> Vertices:
+    return geometry(size).vertices
+
+
+# bordered go board, stones of a chain are linked through "nxt",
+# "libs" and "stones" are kept on the chain head
+class Board:
+    geometry: Geometry
+    size: int
+    size1: int
+    dir: List[int]  # the 4 possible directions
+    points: List[int]  # index of every on-board point, row by row
+    rows: List[int]  # index of the first point of each row
+    bd: bytearray  # 0: empty, 1: white, 2: black, 3: border
+    hash: int  # zobrist hash of bd
+    zobrist: List[List[int]]
+    chain: List[int]  # head point of the chain of each stone
+    nxt: List[int]  # next stone of the same chain
+    libs: List[int]  # pseudo-liberties of each chain by head
+    stones: List[int]  # number of stones of each chain by head
+
+    def __init__(self, size: int) -> None:
+        g = geometry(size)
+        self.geometry = g
+        self.size = size
+        self.size1 = g.size1
+        self.dir = g.dir
+        self.rows = g.rows
+        self.points = g.points
+        self.zobrist = g.zobrist
+        self.bd = bytearray(g.template)
+
+        points = len(self.bd)
+        self.hash = 0
+        self.chain = [0] * points
+        self.nxt = [0] * points
+        self.libs = [0] * points
+        self.stones = [0] * points
+
+    # compute the zobrist hash of the board from scratch
+    # --------------------------------------------------
+    def compute_hash(self) -> int:
+        h = 0
+        for ix, p in enumerate(self.bd):
+            if p == 1 or p == 2:
+                h ^= self.zobrist[p][ix]
+        return h
+
+    # zero-copy view of the bordered board
+    # ------------------------------------
+    def view(self) -> memoryview:
+        return memoryview(self.bd)
+
+    # on-board points of a bordered board "b", row by row
+    # ---------------------------------------------------
+    def crop(self, b: bytearray) -> bytes:
+        size = self.size
+        return b"".join([b[r:r + size] for r in self.rows])
+
+    # copy of the on-board points of the board, row by row
+    # ----------------------------------------------------
+    def snapshot(self) -> bytes:
+        return self.crop(self.bd)
+
+    # recompute hash and chains after bd was modified directly
+    # --------------------------------------------------------
+    def rebuild(self) -> None:
+        bd = self.bd
+        self.hash = self.compute_hash()
+        for ix in range(len(bd)):
+            self.chain[ix] = 0
+        for ix, c in enumerate(bd):
+            if (c == 1 or c == 2) and self.chain[ix] == 0:
+                self.flood(ix)
+
+    # make a new chain with head ix of the connected stones of its color
+    # which do not belong to a chain yet
+    # ------------------------------------------------------------------
+    def flood(self, ix: int) -> None:
+        bd = self.bd
+        chain = self.chain
+        c = bd[ix]
+        chain[ix] = ix
+        group = [ix]
+        libs = 0
+        for p in group:
+            for d in self.dir:
+                q = p + d
+                if bd[q] == 0:
+                    libs += 1
+                elif bd[q] == c and chain[q] == 0:
+                    chain[q] = ix
+                    group.append(q)
+        for i, p in enumerate(group):
+            self.nxt[p] = group[i + 1 - len(group)]
+        self.libs[ix] = libs
+        self.stones[ix] = len(group)
+
+    # stones of the chain containing ix
+    # ---------------------------------
+    def chain_stones(self, ix: int) -> List[int]:
+        ret = [ix]
+        p = self.nxt[ix]
+        while p != ix:
+            ret.append(p)
+            p = self.nxt[p]
+        return ret
+
+    # list of enemy stones captured by a stone of color fst at ix
+    # -----------------------------------------------------------
+    def captures(self, ix: int, fst: int) -> List[int]:
+        bd = self.bd
+        est = fst ^ 3
+        ret: List[int] = []
+        heads: List[int] = []
+        for d in self.dir:
+            p = ix + d
+            if bd[p] == est:
+                h = self.chain[p]
+                if h in heads:
+                    continue
+                heads.append(h)
+                # ix is the last liberty if every pseudo-liberty is at ix
+                touching = 0
+                for d2 in self.dir:
+                    if self.chain[ix + d2] == h and bd[ix + d2] == est:
+                        touching += 1
+                if self.libs[h] == touching:
+                    ret.extend(self.chain_stones(h))
+        return ret
+
+    # would a non capturing stone of color fst at ix have no liberty?
+    # ---------------------------------------------------------------
+    def suicide(self, ix: int, fst: int) -> bool:
+        bd = self.bd
+        libs = 0
+        heads: List[int] = []
+        for d in self.dir:
+            p = ix + d
+            if bd[p] == 0:
+                return False
+            if bd[p] == fst:
+                # the new stone takes one pseudo-liberty of this chain
+                libs -= 1
+                h = self.chain[p]
+                if h not in heads:
+                    heads.append(h)
+                    libs += self.libs[h]
+        return libs == 0
+
+    # zobrist hash after a stone of color fst at ix captures "captured"
+    # -----------------------------------------------------------------
+    def hash_after(self, ix: int, fst: int, captured: List[int]) -> int:
+        h = self.hash ^ self.zobrist[fst][ix]
+        zob = self.zobrist[fst ^ 3]
+        for p in captured:
+            h ^= zob[p]
+        return h
+
+    # a copy of bd after a stone of color fst at ix captures "captured"
+    # -----------------------------------------------------------------
+    def board_after(self, ix: int, fst: int, captured: List[int]) -> bytearray:
+        b = self.bd.copy()
+        b[ix] = fst
+        for p in captured:
+            b[p] = 0
+        return b
+
+    # put a stone of color fst at ix and remove "captured"
+    # the move must have been checked with captures and suicide
+    # ---------------------------------------------------------
+    def place(self, ix: int, fst: int, captured: List[int]) -> None:
+        bd = self.bd
+        chain = self.chain
+        libs = self.libs
+
+        bd[ix] = fst
+        self.hash ^= self.zobrist[fst][ix]
+        chain[ix] = ix
+        self.nxt[ix] = ix
+        self.stones[ix] = 1
+        libs[ix] = 0
+
+        for d in self.dir:
+            p = ix + d
+            c = bd[p]
+            if c == 0:
+                libs[ix] += 1
+            elif c == 1 or c == 2:
+                libs[chain[p]] -= 1
+
+        for d in self.dir:
+            p = ix + d
+            if bd[p] == fst and chain[p] != chain[ix]:
+                self.merge(chain[ix], chain[p])
+
+        zob = self.zobrist[fst ^ 3]
+        for p in captured:
+            bd[p] = 0
+            chain[p] = 0
+            self.hash ^= zob[p]
+        for p in captured:
+            for d in self.dir:
+                q = p + d
+                if bd[q] == 1 or bd[q] == 2:
+                    libs[chain[q]] += 1
+
+    # join chains with heads a and b, the larger head survives
+    # --------------------------------------------------------
+    def merge(self, a: int, b: int) -> None:
+        if self.stones[a] < self.stones[b]:
+            a, b = b, a
+        p = b
+        while True:
+            self.chain[p] = a
+            p = self.nxt[p]
+            if p == b:
+                break
+        self.nxt[a], self.nxt[b] = self.nxt[b], self.nxt[a]
+        self.libs[a] += self.libs[b]
+        self.stones[a] += self.stones[b]
+
+    # take back place(ix, fst, captured), only the chain of ix, the
+    # captured chains and their neighbours are touched
+    # -------------------------------------------------------------
+    def remove(self, ix: int, fst: int, captured: Tuple[int, ...]) -> None:
+        bd = self.bd
+        chain = self.chain
+        libs = self.libs
+        est = fst ^ 3
+
+        # the chain of ix may fall apart, forget it and flood the rest
+        rest = self.chain_stones(ix)
+        for p in rest:
+            chain[p] = 0
+        bd[ix] = 0
+        self.hash ^= self.zobrist[fst][ix]
+        zob = self.zobrist[est]
+        for p in captured:
+            bd[p] = est
+            self.hash ^= zob[p]
+
+        fresh = []
+        for p in rest:
+            if p != ix and chain[p] == 0:
+                self.flood(p)
+                fresh.append(p)
+        for p in captured:
+            if chain[p] == 0:
+                self.flood(p)
+                fresh.append(p)
+
+        # other chains gain the liberty at ix and lose the captured points
+        for d in self.dir:
+            q = ix + d
+            if (bd[q] == 1 or bd[q] == 2) and chain[q] not in fresh:
+                libs[chain[q]] += 1
+        for p in captured:
+            for d in self.dir:
+                q = p + d
+                if bd[q] == fst and chain[q] not in fresh:
+                    libs[chain[q]] -= 1
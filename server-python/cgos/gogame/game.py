@@ -22,8 +22,10 @@
 # THE SOFTWARE.
 
 import datetime
-import json
-from typing import List, Tuple, Optional
+from typing import Dict, Iterable, List, Optional
+
+from .board import vertex_table
+from .moves import SPELLING, Move, MoveList
 
 
 # -----------------------------------------------
@@ -49,8 +51,10 @@ class Game:
     black_remaining_time: int
     white_rate: str
     black_rate: str
-    moves: List[Tuple[str, int, Optional[str]]]
+    moves: MoveList
     ctime: datetime.datetime
+    boardsize: int
+    sgfNodes: List[str]  # SGF nodes of moves[:len(sgfNodes)]
 
     def __init__(
         self,
@@ -61,8 +65,9 @@ class Game:
         black_remaining_time: int,
         white_rate: str,
         black_rate: str,
-        moves: List[Tuple[str, int, Optional[str]]],
+        moves: Iterable[Move],
         ctime: datetime.datetime,
+        boardsize: int = 19,
     ) -> None:
         self.w = w
         self.b = b
@@ -71,8 +76,44 @@ class Game:
         self.black_remaining_time = black_remaining_time
         self.white_rate = white_rate
         self.black_rate = black_rate
-        self.moves = moves
+        self.moves = MoveList(boardsize, moves)
         self.ctime = ctime
+        self.boardsize = boardsize
+        self.sgfNodes = []
+
+    # record a move and its SGF node
+    # ------------------------------
+    def add_move(
+        self, mv: str, t: int, analysis: Optional[str], comment: Optional[str] = None
+    ) -> None:
+        self.moves.append(Move(mv, t, analysis, comment))
+        self.sgfBody(self.boardsize)
+
+    # the SGF nodes of all moves, only moves added since the last call
+    # are rendered
+    # ----------------------------------------------------------------
+    def sgfBody(self, boardsize: int) -> List[str]:
+        if boardsize != self.boardsize or len(self.sgfNodes) > len(self.moves):
+            self.boardsize = boardsize
+            self.sgfNodes = []
+        vertices = vertex_table(boardsize)
+        moves = self.moves
+        start = len(self.sgfNodes)
+
+        # read the columns, points without analysis are rendered here
+        sgfPoint = vertices.sgfPoints(moves.boardsize)
+        rows = zip(moves.points[start:], moves.times[start:], moves.analysisLength[start:])
+        for i, (ix, t, n) in enumerate(rows, start):
+            point = sgfPoint[ix] if ix < SPELLING else ""
+            if point == "" or n >= 0:
+                node = sgfNode(i, *moves.fields(i), boardsize, vertices.sgf)
+            else:
+                col = "BW"[i & 1]
+                node = f";{col}[{point}]{col}L[{t // 1000}]"
+                if i % 8 == 7:
+                    node += "\n"
+            self.sgfNodes.append(node)
+        return self.sgfNodes
 
 
 sgfSpecialChars = str.maketrans(
@@ -87,9 +128,45 @@ def escapeSgfText(s: str) -> str:
     return s.translate(sgfSpecialChars)
 
 
-# returns an SGF game record
-# ---------------------------
-def sgf(
+# SGF node of the move number "i", the fields of a Move
+# ------------------------------------------------------
+def sgfNode(
+    i: int,
+    move: str,
+    time: int,
+    analysis: Optional[str],
+    comment: Optional[str],
+    boardsize: int,
+    sgfPoints: Dict[str, str],
+) -> str:
+    col = "BW"[i & 1]
+    mv = move.lower()
+    tleft = time // 1000
+
+    if mv.startswith("pas") or mv == "resign":
+        s = f";{col}[]{col}L[{tleft}]"
+    else:
+        point = sgfPoints.get(mv)
+        if point is None:
+            ccs = ord(mv[0])
+            if ccs > 104:
+                ccs -= 1
+            rrs = int(mv[1:])
+            rrs = (boardsize - rrs) + 97
+            point = f"{chr(ccs)}{chr(rrs)}"
+        s = f";{col}[{point}]{col}L[{tleft}]"
+    if analysis is not None:
+        s += f"CC[{escapeSgfText(analysis)}]\n"
+        if comment is not None:
+            s += f"C[{escapeSgfText(comment)}]"
+    if i % 8 == 7:
+        s += "\n"
+    return s
+
+
+# SGF root node up to the first move
+# -----------------------------------
+def sgfHeader(
     game: Game,
     serverName: str,
     level: int,
@@ -99,57 +176,50 @@ def sgf(
     gid: int,
     res: str,
     dte: str,
-    err: str,
 ) -> str:
 
-    ctm = 0
-    colstr = ["B", "W"]
-
-    # game = games[gid]
-
     lv = level // 1000
 
     s = "(;GM[1]FF[4]CA[UTF-8]\n"
     s += f"RU[{rule}]SZ[{boardsize}]KM[{komi}]TM[{lv}]\n"
-
-    comment = err
-
     s += f"PW[{game.w}]PB[{game.b}]WR[{game.white_rate}]BR[{game.black_rate}]DT[{dte}]PC[{serverName}]RE[{res: <10}]GN[{gid}]\n"
+    return s
 
-    tmc = 0  # total move count
-
-    for (m, t, analysis) in game.moves:
 
-        mv = m.lower()
-        tleft = t // 1000
-
-        if mv.startswith("pas") or mv == "resign":
-            s += f";{colstr[ctm]}[]{colstr[ctm]}L[{tleft}]"
-        else:
-            ccs = ord(mv[0])
-            if ccs > 104:
-                ccs -= 1
-            rrs = int(mv[1:])
-            rrs = (boardsize - rrs) + 97
-            s += f";{colstr[ctm]}[{chr(ccs)}{chr(rrs)}]{colstr[ctm]}L[{tleft}]"
-        if analysis is not None:
-            s += f"CC[{escapeSgfText(analysis)}]\n"
-            v = json.loads(analysis)
-            if "comment" in v:
-                c = v["comment"]
-                s += f"C[{escapeSgfText(c)}]"
-        tmc += 1
-        if tmc > 7:
-            s += "\n"
-            tmc = 0
-        ctm = ctm ^ 1
-
-    if comment != "":
-        s += f";C[{escapeSgfText(comment)}]\n"
+# SGF after the last move
+# -----------------------
+def sgfTail(res: str, err: str) -> str:
+    s = ""
+    if err != "":
+        s += f";C[{escapeSgfText(err)}]\n"
 
     if res == "?":
         s += "CZ[]"
 
     s += ")\n"
+    return s
+
+
+# returns an SGF game record
+# ---------------------------
+def sgf(
+    game: Game,
+    serverName: str,
+    level: int,
+    rule: str,
+    boardsize: int,
+    komi: float,
+    gid: int,
+    res: str,
+    dte: str,
+    err: str,
+) -> str:
+
+    s = sgfHeader(game, serverName, level, rule, boardsize, komi, gid, res, dte)
+
+    # moves are rendered once and kept by the game
+    s += "".join(game.sgfBody(boardsize))
+
+    s += sgfTail(res, err)
 
     return s
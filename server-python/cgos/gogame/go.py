@@ -23,21 +23,61 @@
 
 from __future__ import annotations
 
+from array import array
+from collections import Counter
 from enum import Enum
+from itertools import accumulate
+import random
 import re
-from typing import List, Dict
+import struct
+import sys
+from typing import Dict, Iterable, List, Tuple
 from util.logutils import getLogger
 
+from .board import Board, Vertices
+from .score import AreaScore, score_area
+
 logger = getLogger("cgos_server")
 
 RE_MOVE = re.compile(r"^[a-z]\d+")
 
+# characters of to_string for empty, white, black and border points
+PRETTY_POINTS = bytes.maketrans(bytes([0, 1, 2, 3]), b".OX#")
+
+# A full board copy is kept every KEYFRAME_INTERVAL plies, positions in
+# between are rebuilt from the undo log
+KEYFRAME_INTERVAL = 32
+
+# largest board with GTP vertex letters, A to Z without I
+MAX_BOARD_SIZE = 25
+
+# to_bytes header: magic, version, board size, ko rule, ctm, keyframes
+SNAPSHOT_HEADER = struct.Struct("<4sBBBxII")
+SNAPSHOT_MAGIC = b"CGGS"
+SNAPSHOT_VERSION = 1
+
+
+# description of the error codes of GoGame.make, by -code
+ERR_MSG = [
+    "huh",
+    "suicide attempted",
+    "KO attempted",
+    "move to occupied point",
+    "do not understand syntax",
+]
+
 
 class KoRule(Enum):
     SIMPLE = 0
     POSITIONAL = 1
 
 
+class RepetitionLog(Enum):
+    OFF = 0  # no diagnostic
+    SAMPLED = 1  # check a fraction of the moves
+    FULL = 2  # check every move
+
+
 class Rule:
     koRule: KoRule
 
@@ -50,33 +90,103 @@ class GoGame:
     __LEGAL_COORDINATES = "abcdefghjklmnopqrstuvwxyz"
 
     ctm: int  # where in the game we are
-    bd: List[int]
+    board: Board
+    vertices: Vertices
     size: int
     size1: int
-    his: Dict[int, List[int]]  # a list of board copies
+    undo: List[Tuple[int, Tuple[int, ...]]]  # (point, captured) of each ply
+    keyframes: Dict[int, bytes]  # board copies every KEYFRAME_INTERVAL
+    hashes: List[int]  # zobrist hash of the board at each ply
+    positions: Dict[int, int]  # number of plies by board hash
     moves: List[str]  # a list of moves
     dir: List[int]  # the 4 possible directions
     rule: Rule
 
+    # log moves which repeat an earlier board, shared by all games
+    repetitionLog: RepetitionLog = RepetitionLog.OFF
+    repetitionSampleRate: float = 0.01
+
     def __init__(self, size: int, rule: Rule) -> None:
-        self.bd = []
+        self.board = Board(size)
+        self.vertices = self.board.geometry.vertices
         self.ctm = 0
         self.size = size
         self.size1 = size + 1
-        self.dir = [-1, 1, self.size1, -1 * self.size1]
+        self.dir = self.board.dir
         self.moves = []
-        self.his = dict()
         self.rule = rule
+        self.reset_history()
+
+    # the bordered board, 0: empty, 1: white, 2: black, 3: border
+    # -----------------------------------------------------------
+    @property
+    def bd(self) -> bytearray:
+        return self.board.bd
+
+    # start the history with the current board as the position at ctm
+    # ---------------------------------------------------------------
+    def reset_history(self) -> None:
+        self.undo = []
+        self.keyframes = {self.ctm: bytes(self.bd)}
+        self.hashes = [self.board.hash]
+        self.positions = {self.board.hash: 1}
+
+    # record the move which lead to the position at ctm
+    # -------------------------------------------------
+    def push_history(self, ix: int, captured: List[int]) -> None:
+        self.undo.append((ix, tuple(captured)))
+        if self.ctm % KEYFRAME_INTERVAL == 0:
+            self.keyframes[self.ctm] = bytes(self.bd)
+        h = self.board.hash
+        self.hashes.append(h)
+        self.positions[h] = self.positions.get(h, 0) + 1
+
+    # forget the position at ctm, return the move which lead to it
+    # ------------------------------------------------------------
+    def pop_history(self) -> Tuple[int, Tuple[int, ...]]:
+        h = self.hashes.pop()
+        n = self.positions[h] - 1
+        if n > 0:
+            self.positions[h] = n
+        else:
+            del self.positions[h]
+        if self.ctm in self.keyframes and self.ctm > 0:
+            del self.keyframes[self.ctm]
+        return self.undo.pop()
+
+    # rebuild the board of an earlier position from the nearest keyframe
+    # ------------------------------------------------------------------
+    def position_at(self, ply: int) -> bytearray:
+        start = ply - ply % KEYFRAME_INTERVAL
+        b = bytearray(self.keyframes[start])
+        for i in range(start, ply):
+            ix, captured = self.undo[i]
+            if ix != 0:
+                b[ix] = 2 - (i & 1)
+                for p in captured:
+                    b[p] = 0
+        return b
 
-        for y in range(self.size + 2):
-            for x in range(self.size1):
-                if y < 1 or y > self.size or x == 0:
-                    self.bd.append(3)
-                else:
-                    self.bd.append(0)
-        self.his[self.ctm] = self.bd.copy()
+    # did board "b" with hash "h" occur between ply "first" and "last"?
+    # hash lookup first, full comparison only to confirm a hit
+    # -----------------------------------------------------------------
+    def repeated(self, h: int, b: bytearray, first: int, last: int) -> bool:
+        if h not in self.positions:
+            return False
+        for i in range(first, last + 1):
+            if self.hashes[i] == h and self.position_at(i) == b:
+                return True
+        return False
 
     def mvToIndex(self, mv: str) -> int:
+        ix = self.vertices.index.get(mv)
+        if ix is not None:
+            return ix
+        return self.parseVertex(mv)
+
+    # slow path of mvToIndex for unusual spellings like "pa" or "c03"
+    # ---------------------------------------------------------------
+    def parseVertex(self, mv: str) -> int:
         m = mv.lower()
 
         if m[0:2] == "pa":
@@ -84,10 +194,10 @@ class GoGame:
 
         match = re.search(RE_MOVE, m)
         if match is not None:
-            y = self.size1 - int(m[1:])  # [string range $m 1 2]]
-            if y > self.size or y <= 0:
-                return -4
             try:
+                y = self.size1 - int(m[1:])  # [string range $m 1 2]]
+                if y > self.size or y <= 0:
+                    return -4
                 x = self.__LEGAL_COORDINATES.index(m[0:1]) + 1
                 if x > self.size:
                     return -4
@@ -99,86 +209,30 @@ class GoGame:
 
         return y * self.size1 + x  # index of point on board
 
-    # return a list of captured stones
-    # --------------------------------
-    def capture_group(self, target: int) -> List[int]:
-        tbd = self.bd.copy()  # copy of board for restoration if needed
-        lst = [target]
-        est = self.bd[target]  # enemy (color of group to be captured)
-        ret = [target]  # list of stones to return
-        # flag($target) = 1
-        flag = {target: 1}
-
-        while True:
-            nlst = []  # build a new list
-            for ix in lst:
-                for d in self.dir:
-                    p = d + ix
-
-                    if self.bd[p] == 0:
-                        self.bd = tbd
-                        return []  # nothing captured nothing gained
-
-                    if self.bd[p] == est:
-                        if p not in flag:
-                            nlst.append(p)
-                            ret.append(p)  # list of stones to be captured
-                            flag[p] = 1
-
-            if len(nlst) == 0:
-                for ix in ret:
-                    # set bd [lreplace $bd $ix $ix 0]
-                    self.bd[ix] = 0
-                return ret
-            else:
-                lst = nlst
-
     def colorToMove(self) -> int:
         return self.ctm
 
-    # return a "board" with correct status
-    # ------------------------------------
-    def score_board(self, dead_list: List[str]) -> List[int]:
-        b = self.bd.copy()  # work from a copy
+    # tromp/taylor area count after removing the dead stones
+    # -------------------------------------------------------
+    def score(self, dead_list: List[str]) -> AreaScore:
+        b = bytearray(self.board.snapshot())
 
         # kill the dead stones
         # --------------------------------
         for s in dead_list:
             imv = self.mvToIndex(s)
-            b[imv] = 0
-
-        for x in range(1, self.size1):
-            for y in range(1, self.size1):
-                i = y * self.size1 + x
-
-                if b[i] == 0:  # empty square and hasn't been covered yet
-                    lst = [i]
-                    cc = 0  # color of surrounding stones
-                    flag = {i: 1}
-
-                    while True:
-                        nlst = []
-                        # build a new list
-                        for ix in lst:
-                            for d in self.dir:
-                                p = d + ix
-
-                                if b[p] == 0 and p not in flag:
-                                    nlst.append(p)
-                                    flag[p] = 1
-                                elif b[p] == 1:
-                                    cc = cc | 1
-                                elif b[p] == 2:
-                                    cc = cc | 2
-
-                        if len(nlst) == 0:
-                            if cc == 1 or cc == 2:
-                                for ix in flag.keys():
-                                    b[ix] = cc
-                            del flag
-                            break
-                        else:
-                            lst = nlst
+            if imv > 0:
+                b[(imv // self.size1 - 1) * self.size + imv % self.size1 - 1] = 0
+
+        return score_area(bytes(b), self.size)
+
+    # return a "board" with correct status
+    # ------------------------------------
+    def score_board(self, dead_list: List[str]) -> bytearray:
+        final = self.score(dead_list).board
+        b = self.bd.copy()
+        for y, r in enumerate(self.board.rows):
+            b[r:r + self.size] = final[y * self.size:(y + 1) * self.size]
         return b
 
     #  make -
@@ -192,70 +246,100 @@ class GoGame:
     #   --------------------------------------
     def make(self, mov: str) -> int:
 
-        mv = mov.upper()
+        ix = self.mvToIndex(mov)
+
+        # set ix [expr $y * $n1 + $x]   ;# index of point on board
+        if ix < 0:
+            return ix
+
+        return self.play(ix, True)
+
+    # play the move at point ix (0 for pass), return value as make
+    # "diagnose" logs a board repeating an earlier position
+    # -------------------------------------------------------------
+    def play(self, ix: int, diagnose: bool) -> int:
+
         fst = 2 - (self.ctm & 1)  # friendly stone color
-        est = fst ^ 3  # enemy stone color
 
-        if mv[0:2] == "PA":
+        if ix == 0:
             self.moves.append("PASS")
             self.ctm += 1
-            self.his[self.ctm] = self.bd.copy()
+            self.push_history(0, [])
             return 0
 
-        ix = self.mvToIndex(mv)
-
-        # set ix [expr $y * $n1 + $x]   ;# index of point on board
-        if ix < 0:
-            return ix
-
-        if self.bd[ix] != 0:
+        board = self.board
+        if board.bd[ix] != 0:
             return -3  # move to occupied square
 
-        self.bd[ix] = fst
-
         # determine if a capture was made in one or more directions
         # ---------------------------------------------------------
-        clist = []
-        for d in self.dir:
-            p = d + ix
-            if self.bd[p] == est:
-                clist.extend(self.capture_group(p))
+        clist = board.captures(ix, fst)
 
         # is the move suicidal?
         # ---------------------
         if len(clist) == 0:  # move was not a capture!
-            if len(self.capture_group(ix)) > 0:
-                self.bd = self.his[self.ctm].copy()
+            if board.suicide(ix, fst):
                 return -1
 
         # test for KO
         # ------------
-        for i in range(self.ctm):
-            if self.his[i] == self.bd:
-                logger.info(f"KO positional: {i} == {self.ctm} {mov}")
-
-        if self.rule.koRule == KoRule.POSITIONAL:
-            for i in range(self.ctm):
-                if self.his[i] == self.bd:
-                    self.bd = self.his[self.ctm].copy()
+        h = board.hash_after(ix, fst, clist)
+        if h in self.positions:
+            after = board.board_after(ix, fst, clist)
+            if diagnose and self.repetitionLog != RepetitionLog.OFF:
+                self.log_repetition(h, after, ix)
+
+            if self.rule.koRule == KoRule.POSITIONAL:
+                if self.ctm > 0 and self.repeated(h, after, 0, self.ctm - 1):
                     return -2  # KO move
-        if self.rule.koRule == KoRule.SIMPLE:
-            if self.ctm > 0:
-                if self.his[self.ctm - 1] == self.bd:
-                    self.bd = self.his[self.ctm].copy()
+            if self.rule.koRule == KoRule.SIMPLE:
+                if self.ctm > 0 and self.repeated(h, after, self.ctm - 1, self.ctm - 1):
                     return -2  # KO move
 
         # ok, the move was apparently valid!  accept it.
         # ----------------------------------------------
-        self.moves.append(mv)
+        board.place(ix, fst, clist)
+        self.moves.append(self.vertices.vertex[ix])
         self.ctm += 1
-        self.his[self.ctm] = self.bd.copy()
+        self.push_history(ix, clist)
         return len(clist)
 
+    # log every earlier ply with board "b", which has hash "h"
+    # ---------------------------------------------------------
+    def log_repetition(self, h: int, b: bytearray, ix: int) -> None:
+        if self.repetitionLog == RepetitionLog.SAMPLED:
+            if random.random() >= self.repetitionSampleRate:
+                return
+        for i in range(self.ctm):
+            if self.hashes[i] == h and self.position_at(i) == b:
+                mv = self.vertices.vertex[ix]
+                logger.info(f"KO positional: {i} == {self.ctm} {mv}")
+
+    #  replay - play a whole list of moves, e.g. to resume a game
+    #
+    #   Return: (-1, 0)  if every move was legal
+    #   Return: (index, error)  of the first illegal move, error as make
+    #   ---------------------------------------------------------------
+    def replay(self, moves: Iterable[str]) -> Tuple[int, int]:
+        index = self.vertices.index
+        for i, mv in enumerate(moves):
+            ix = index.get(mv)
+            if ix is None:
+                ix = self.parseVertex(mv)
+                if ix < 0:
+                    return i, ix
+            err = self.play(ix, False)
+            if err < 0:
+                return i, err
+        return -1, 0
+
     def unmake(self) -> bool:
         if self.ctm > 0:
+            ix, captured = self.pop_history()
             self.ctm -= 1
-            self.bd = self.his[self.ctm].copy()
+            self.moves.pop()
+            if ix != 0:
+                self.board.remove(ix, 2 - (self.ctm & 1), captured)
             return True
         else:
             return False
@@ -292,22 +376,18 @@ class GoGame:
         print(self.to_string(pretty))
 
     def to_string(self, pretty=True) -> str:
+        if pretty:
+            rows = self.board.snapshot().translate(PRETTY_POINTS)
+            out = ""
+            for y in range(self.size):
+                out += rows[y * self.size:(y + 1) * self.size].decode("ascii") + "\n"
+            return out
+
         out = ""
         for y in range(1, self.size + 1):
             for x in range(1, self.size + 1):
                 ix = y * self.size1 + x
-                p = self.bd[ix]
-                if pretty:
-                    if p == 0:
-                        out += "."
-                    elif p == 1:
-                        out += "O"
-                    elif p == 2:
-                        out += "X"
-                    elif p == 3:
-                        out += "#"
-                else:
-                    out += "%3d" % (self.bd[ix])
+                out += "%3d" % (self.bd[ix])
             out += "\n"
         return out
 
@@ -336,39 +416,106 @@ class GoGame:
                     raise ValueError(f"unexpected character {p} at {x} {y}")
                 game.bd[ix] = v
 
-        game.his[game.ctm] = game.bd.copy()
+        game.board.rebuild()
+        game.reset_history()
 
         return game
 
+    #  to_bytes - binary snapshot of the game, for from_bytes
+    #
+    #   header, bordered board, the point of each move, the number of
+    #   captured stones of each move and their points, keyframe plies and
+    #   boards, and the hash of each position; integers are little endian
+    #   ---------------------------------------------------------------
+    def to_bytes(self) -> bytes:
+        plies = sorted(self.keyframes)
+        counts = array("H", [len(c) for _, c in self.undo])
+        captured = array("H", [p for _, c in self.undo for p in c])
+        arrays = [
+            array("H", [ix for ix, _ in self.undo]),
+            counts,
+            captured,
+            array("I", plies),
+            array("Q", self.hashes),
+        ]
+        if sys.byteorder == "big":
+            for a in arrays:
+                a.byteswap()
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.size, self.rule.koRule.value, self.ctm, len(plies)
+        )
+        keyframes = b"".join([self.keyframes[i] for i in plies])
+        mv, cnt, cap, kf, hs = [a.tobytes() for a in arrays]
+        return b"".join([header, self.bd, mv, cnt, cap, kf, keyframes, hs])
+
+    @staticmethod
+    def from_bytes(data: bytes) -> GoGame:
+        if len(data) < SNAPSHOT_HEADER.size:
+            raise ValueError("truncated game snapshot")
+        magic, version, size, koRule, ctm, nkeys = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"not a game snapshot {magic!r} version {version}")
+        if size < 1 or size > MAX_BOARD_SIZE:
+            raise ValueError(f"bad board size {size} in game snapshot")
+
+        game = GoGame(size, Rule(KoRule(koRule)))
+        view = memoryview(data)
+        pos = SNAPSHOT_HEADER.size
+
+        def take(typecode: str, n: int) -> array:
+            nonlocal pos
+            a = array(typecode)
+            end = pos + n * a.itemsize
+            if end > len(data):
+                raise ValueError("truncated game snapshot")
+            a.frombytes(view[pos:end])
+            if sys.byteorder == "big":
+                a.byteswap()
+            pos = end
+            return a
+
+        n = len(game.bd)
+        game.bd[:] = take("B", n)
+        points = take("H", ctm)
+        counts = take("H", ctm)
+        captured = take("H", sum(counts))
+        plies = take("I", nkeys)
+        frames = take("B", n * nkeys).tobytes()
+        hashes = take("Q", ctm + 1)
+        if pos != len(data):
+            raise ValueError("trailing bytes in game snapshot")
+
+        vertex = game.vertices.vertex
+        if any(ix >= n or (ix != 0 and vertex[ix] == "") for ix in points):
+            raise ValueError("move off the board in game snapshot")
+        if any(p == 0 or p >= n or vertex[p] == "" for p in captured):
+            raise ValueError("capture off the board in game snapshot")
+        if sorted(plies) != list(range(0, ctm + 1, KEYFRAME_INTERVAL)):
+            raise ValueError("keyframes do not cover the game snapshot")
+        game.ctm = ctm
+        game.moves = [vertex[ix] for ix in points]
+        ends = list(accumulate(counts))
+        caps = captured.tolist()
+        game.undo = [(ix, tuple(caps[e - c:e])) for ix, c, e in zip(points, counts, ends)]
+        game.keyframes = {ply: frames[k * n:(k + 1) * n] for k, ply in enumerate(plies)}
+        game.hashes = hashes.tolist()
+        game.positions = dict(Counter(game.hashes))
+        game.board.rebuild()
+        if game.board.hash != game.hashes[-1]:
+            raise ValueError("board does not match the game snapshot")
+        return game
+
     # return a copy of the current board as a tcl list
     # ------------------------------------------------
     def getboard(self) -> List[int]:
-        board = []
-        for y in range(1, self.size + 1):
-            for x in range(1, self.size + 1):
-                ix = y * self.size1 + x
-                board.append(self.bd[ix])
-        return board
+        return list(self.board.snapshot())
 
     # return a copy of the current board as a tcl list
     # ------------------------------------------------
     def getFinalBoard(self, dead: List[str]) -> List[int]:
-        b = self.score_board(dead)
-        board = []
-        for y in range(1, self.size + 1):
-            for x in range(1, self.size + 1):
-                ix = y * self.size1 + x
-                board.append(b[ix])
-        return board
+        return list(self.score(dead).board)
 
     # tromp/taylor chinese style scoring
     # ----------------------------------
     def ttScore(self) -> int:
-        tbd = self.getFinalBoard([])
-        score = 0
-        for j in tbd:
-            if j == 2:
-                score += 1
-            elif j == 1:
-                score -= 1
-        return score
+        return self.score([]).score
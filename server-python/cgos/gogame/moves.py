@@ -0,0 +1,175 @@
+# The MIT License
+#
+# Copyright (C) 2009 Don Dailey and Jason House
+# Copyright (c) 2022 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, overload
+
+from .board import vertex_table
+
+
+# a move as it arrived from the player
+class Move(NamedTuple):
+    move: str
+    time: int  # remaining time in ms
+    analysis: Optional[str]  # genmove_analyze JSON, compact
+    comment: Optional[str]  # "comment" of the analysis
+
+
+# the "comment" of a parsed genmove_analyze object
+# ------------------------------------------------
+def analysisComment(info: Any) -> Optional[str]:
+    if isinstance(info, dict) and "comment" in info:
+        return str(info["comment"])
+    return None
+
+
+# codes of moves which are not an upper case vertex
+SPELLING = 0x8000
+
+ENCODING = "utf-8"
+
+
+# moves of a game in array columns, a move is the point of its vertex
+# or SPELLING + index in "spellings"
+class MoveList(Sequence[Move]):
+    boardsize: int
+    points: array  # uint16 move code
+    times: array  # int32 remaining time in ms
+    analysisStart: array  # uint32 offset in analyses
+    analysisLength: array  # int32 length in analyses, -1 for none
+    analyses: bytearray
+    comments: Dict[int, str]  # comment by move number
+    spellings: List[str]
+    wireEnd: array  # uint32 end of each move in wire
+
+    def __init__(self, boardsize: int, moves: Iterable[Move] = ()) -> None:
+        self.boardsize = boardsize
+        self._vertices = vertex_table(boardsize)
+        self.points = array("H")
+        self.times = array("i")
+        self.analysisStart = array("I")
+        self.analysisLength = array("i")
+        self.analyses = bytearray()
+        self.comments = dict()
+        self.spellings = []
+        self._spellingIndex: Dict[str, int] = dict()
+        self._wire = bytearray()
+        self._wireText: Optional[str] = None
+        self.wireEnd = array("I")
+        for m in moves:
+            self.append(m)
+
+    def append(self, m: Move) -> None:
+        ix = self._vertices.index.get(m.move, -1)
+        if ix < 0 or self._vertices.vertex[ix] != m.move:
+            k = self._spellingIndex.get(m.move)
+            if k is None:
+                k = len(self.spellings)
+                self._spellingIndex[m.move] = k
+                self.spellings.append(m.move)
+            ix = SPELLING + k
+        i = len(self.points)
+        self.points.append(ix)
+        self.times.append(m.time)
+
+        self.analysisStart.append(len(self.analyses))
+        if m.analysis is None:
+            self.analysisLength.append(-1)
+        else:
+            data = m.analysis.encode(ENCODING)
+            self.analysisLength.append(len(data))
+            self.analyses += data
+        if m.comment is not None:
+            self.comments[i] = m.comment
+
+        if i > 0:
+            self._wire += b" "
+        self._wire += f"{m.move} {m.time}".encode(ENCODING)
+        self.wireEnd.append(len(self._wire))
+        self._wireText = None
+
+    def move(self, i: int) -> str:
+        ix = self.points[i]
+        if ix >= SPELLING:
+            return self.spellings[ix - SPELLING]
+        return self._vertices.vertex[ix]
+
+    # "move time move time ..." of all moves
+    # --------------------------------------
+    def wire(self) -> str:
+        if self._wireText is None:
+            self._wireText = self._wire.decode(ENCODING)
+        return self._wireText
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @overload
+    def __getitem__(self, i: int) -> Move:
+        ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "MoveList":
+        ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return MoveList(self.boardsize, [self[k] for k in range(*i.indices(len(self)))])
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("move index out of range")
+        return Move(*self.fields(i))
+
+    # (move, time, analysis, comment) of the move "i"
+    # -----------------------------------------------
+    def fields(self, i: int) -> Tuple[str, int, Optional[str], Optional[str]]:
+        analysis = None
+        n = self.analysisLength[i]
+        if n >= 0:
+            start = self.analysisStart[i]
+            analysis = self.analyses[start:start + n].decode(ENCODING)
+        return self.move(i), self.times[i], analysis, self.comments.get(i)
+
+    def __iter__(self) -> Iterator[Move]:
+        for fields in self.columns():
+            yield Move(*fields)
+
+    # (move, time, analysis, comment) of the moves from "start", read
+    # straight from the columns
+    # ---------------------------------------------------------------
+    def columns(self, start: int = 0) -> Iterator[Tuple[str, int, Optional[str], Optional[str]]]:
+        vertex = self._vertices.vertex
+        spellings = self.spellings
+        analyses = self.analyses
+        comments = self.comments
+        rows = zip(
+            self.points[start:],
+            self.times[start:],
+            self.analysisStart[start:],
+            self.analysisLength[start:],
+        )
+        for i, (ix, t, a, n) in enumerate(rows, start):
+            mv = vertex[ix] if ix < SPELLING else spellings[ix - SPELLING]
+            analysis = analyses[a:a + n].decode(ENCODING) if n >= 0 else None
+            yield mv, t, analysis, comments.get(i) if comments else None
@@ -0,0 +1,64 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import random
+
+from .go import GoGame
+
+
+# is ix surrounded by stones of color fst only?
+# ---------------------------------------------
+def is_eye(game: GoGame, ix: int, fst: int) -> bool:
+    bd = game.bd
+    for d in game.dir:
+        c = bd[ix + d]
+        if c != fst and c != 3:
+            return False
+    return True
+
+
+# play one random legal move which does not fill an own eye
+# return the point played, 0 for pass
+# ---------------------------------------------------------
+def random_move(game: GoGame, rng: random.Random) -> int:
+    bd = game.bd
+    fst = 2 - (game.ctm & 1)
+    candidates = [ix for ix in game.board.points if bd[ix] == 0]
+    while len(candidates) > 0:
+        i = rng.randrange(len(candidates))
+        ix = candidates[i]
+        if not is_eye(game, ix, fst) and game.play(ix, False) >= 0:
+            return ix
+        candidates[i] = candidates[-1]
+        candidates.pop()
+    game.play(0, False)
+    return 0
+
+
+# play random moves until both players pass or "max_moves" plies
+# 0 means three times the number of points
+# --------------------------------------------------------------
+def random_playout(game: GoGame, rng: random.Random, max_moves: int = 0) -> None:
+    if max_moves <= 0:
+        max_moves = 3 * game.size * game.size
+    while game.ctm < max_moves and not game.twopass():
+        random_move(game, rng)
@@ -0,0 +1,168 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from typing import List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
+
+# Tromp-Taylor area count of a board, points row by row
+# 0: empty, 1: white, 2: black
+class AreaScore:
+    black: int  # black stones and black territory
+    white: int  # white stones and white territory
+    board: bytes  # stones, and the owner of each empty point
+    territory: bytes  # the owner of each empty point, 0 for stones
+    regions: List[int]  # region of each point, -1 for stones
+    owners: List[int]  # owner of each region, 0 if it touches both or none
+
+    def __init__(
+        self, board: bytes, territory: bytes, regions: List[int], owners: List[int]
+    ) -> None:
+        self.board = board
+        self.territory = territory
+        self.regions = regions
+        self.owners = owners
+        self.black = board.count(2)
+        self.white = board.count(1)
+
+    # black minus white, without komi
+    # -------------------------------
+    @property
+    def score(self) -> int:
+        return self.black - self.white
+
+
+# score a board, with numpy when it is available
+# ----------------------------------------------
+def score_area(board: bytes, size: int) -> AreaScore:
+    if np is not None:
+        return score_area_numpy(board, size)
+    return score_area_union_find(board, size)
+
+
+def _finish(board: bytes, regions: List[int], owners: List[int]) -> AreaScore:
+    territory = bytes([0 if r < 0 else owners[r] for r in regions])
+    final = bytes([c if r < 0 else owners[r] for c, r in zip(board, regions)])
+    return AreaScore(final, territory, regions, owners)
+
+
+# label empty regions with a union-find over the points
+# -----------------------------------------------------
+def score_area_union_find(board: bytes, size: int) -> AreaScore:
+    n = size * size
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # one pass joining each empty point with its left and upper neighbour
+    for i in range(n):
+        if board[i] != 0:
+            continue
+        if i % size > 0 and board[i - 1] == 0:
+            a, b = find(i), find(i - 1)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+        if i >= size and board[i - size] == 0:
+            a, b = find(i), find(i - size)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+    regions = [-1] * n
+    label = [-1] * n
+    masks: List[int] = []
+    for i in range(n):
+        if board[i] != 0:
+            continue
+        r = find(i)
+        if label[r] < 0:
+            label[r] = len(masks)
+            masks.append(0)
+        region = label[r]
+        regions[i] = region
+
+        x = i % size
+        mask = 0
+        if x > 0:
+            mask |= board[i - 1]
+        if x < size - 1:
+            mask |= board[i + 1]
+        if i >= size:
+            mask |= board[i - size]
+        if i < n - size:
+            mask |= board[i + size]
+        masks[region] |= mask
+
+    owners = [m if m == 1 or m == 2 else 0 for m in masks]
+    return _finish(board, regions, owners)
+
+
+# label empty regions with numpy by propagating the smallest point index
+# through each region, with pointer jumping to cut the number of passes
+# ----------------------------------------------------------------------
+def score_area_numpy(board: bytes, size: int) -> AreaScore:
+    n = size * size
+    b = np.frombuffer(board, dtype=np.uint8).reshape(size, size)
+    empty = b == 0
+
+    # stones carry the sentinel n which never wins a minimum
+    lab = np.where(empty, np.arange(n).reshape(size, size), n)
+    while True:
+        m = lab.copy()
+        np.minimum(m[:, 1:], lab[:, :-1], out=m[:, 1:])
+        np.minimum(m[:, :-1], lab[:, 1:], out=m[:, :-1])
+        np.minimum(m[1:, :], lab[:-1, :], out=m[1:, :])
+        np.minimum(m[:-1, :], lab[1:, :], out=m[:-1, :])
+        m[~empty] = n
+        flat = np.append(m.ravel(), n)
+        m = flat[m]
+        if np.array_equal(m, lab):
+            break
+        lab = m
+
+    colors = b.astype(np.int64)
+    mask = np.zeros((size, size), dtype=np.int64)
+    mask[:, 1:] |= colors[:, :-1]
+    mask[:, :-1] |= colors[:, 1:]
+    mask[1:, :] |= colors[:-1, :]
+    mask[:-1, :] |= colors[1:, :]
+
+    roots, inverse = np.unique(lab[empty], return_inverse=True)
+    masks = np.zeros(len(roots), dtype=np.int64)
+    np.bitwise_or.at(masks, inverse, mask[empty])
+
+    owners = np.where((masks == 1) | (masks == 2), masks, 0)
+    regions = np.full((size, size), -1, dtype=np.int64)
+    regions[empty] = inverse
+    territory = np.zeros((size, size), dtype=np.uint8)
+    territory[empty] = owners[inverse]
+    final = b | territory
+    return AreaScore(
+        final.tobytes(), territory.tobytes(), regions.ravel().tolist(), owners.tolist()
+    )
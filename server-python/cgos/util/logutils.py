@@ -22,9 +22,51 @@
 
 import logging
 import logging.config
+import random
+from typing import Optional
 
 logging.config.fileConfig("log.ini")
 
 
 def getLogger(name: str) -> logging.Logger:
     return logging.getLogger(name)
+
+
+# is a record of "level" written by some handler of "logger"?
+# logger.isEnabledFor only looks at the logger levels
+# ------------------------------------------------------------
+def isEmitted(logger: logging.Logger, level: int) -> bool:
+    if not logger.isEnabledFor(level):
+        return False
+    c: Optional[logging.Logger] = logger
+    while c is not None:
+        if any(h.level <= level for h in c.handlers):
+            return True
+        c = c.parent if c.propagate else None
+    return False
+
+
+# which connections log every message, "rate" of them at "level",
+# all at DEBUG when DEBUG records of "logger" are handled
+class WireTrace:
+    logger: logging.Logger
+    rate: float
+    level: int
+
+    def __init__(self, logger: logging.Logger, rate: float = 0.0) -> None:
+        self.logger = logger
+        self.configure(rate)
+
+    def configure(self, rate: float, level: int = logging.INFO) -> None:
+        self.rate = rate
+        self.level = level
+        self._debug = isEmitted(self.logger, logging.DEBUG)
+
+    # the level of a new connection, 0 if it is not traced
+    # ----------------------------------------------------
+    def connectionLevel(self) -> int:
+        if self._debug:
+            return logging.DEBUG
+        if self.rate > 0.0 and random.random() < self.rate:
+            return self.level
+        return 0
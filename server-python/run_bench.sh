@@ -0,0 +1,3 @@
+#!/bin/bash
+
+PYTHONPATH=$PYTHONPATH:./cgos python3 benchmarks/bench_gogame.py --baseline benchmarks/baseline.json "$@"
@@ -1,3 +1,5 @@
 #!/bin/bash
+set -e
 
 PYTHONPATH=$PYTHONPATH:./cgos python3 -m unittest discover tests.gogame
+PYTHONPATH=$PYTHONPATH:./cgos python3 -m unittest discover tests.app
@@ -0,0 +1,86 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import random
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+import audit_archive
+from audit_archive import check_range, check_record, init_worker, score_result
+from gogame import GoGame, KoRule, Rule
+from gogame.playout import random_playout
+
+
+def record(moves, res, size=9, komi=7.5):
+    mvs = " ".join(f"{mv} 1000" for mv in moves)
+    return f"2023-01-01 10:00 {size} {komi} w(1800) b(1800) 300000 {mvs} {res}"
+
+
+class TestAudit(TestCase):
+
+    def setUp(self):
+        self.rule = Rule(KoRule.POSITIONAL)
+        game = GoGame(9, self.rule)
+        random_playout(game, random.Random(1))
+        self.assertTrue(game.twopass())
+        self.moves = game.list_moves()
+        self.res = score_result(game, 7.5)
+
+    def test_check_record(self):
+        self.assertIsNone(check_record(record(self.moves, self.res), self.rule))
+        self.assertEqual(
+            check_record(record(self.moves, "B+100.5"), self.rule),
+            f"result B+100.5 but the score is {self.res}",
+        )
+        self.assertEqual(
+            check_record(record(self.moves[:-1], self.res), self.rule),
+            f"scored {self.res} without two passes",
+        )
+        self.assertIsNone(check_record(record(["E5", "resign"], "B+Resign"), self.rule))
+        self.assertIsNone(check_record(record(["E5", "pass"], "B+Illegal"), self.rule))
+        self.assertEqual(
+            check_record(record(["E5", "E5"], "W+Time"), self.rule),
+            "illegal move 2 E5: move to occupied point",
+        )
+        self.assertEqual(check_record("2023-01-01 10:00 9", self.rule), "malformed record")
+
+    def test_check_range(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "archive.db")
+            db = sqlite3.connect(path)
+            db.execute("create table games(gid int, dta, analysis)")
+            db.execute("INSERT INTO games VALUES(?, ?, ?)", (10, record(self.moves, self.res), ""))
+            db.execute("INSERT INTO games VALUES(?, ?, ?)", (11, record(self.moves, "Draw"), ""))
+            db.commit()
+            db.close()
+
+            init_worker(path, KoRule.POSITIONAL)
+            try:
+                count, bad = check_range(1, 3)
+                self.assertEqual(count, 2)
+                self.assertEqual(bad, [(11, f"result Draw but the score is {self.res}")])
+                self.assertEqual(check_range(2, 3), (1, bad))
+            finally:
+                audit_archive.archive.close()
@@ -0,0 +1,382 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import asyncio
+import logging
+from typing import List
+from unittest import IsolatedAsyncioTestCase
+
+from app.client import (
+    MAX_LINE,
+    MAX_WRITE_BUFFER,
+    PLAYER_POLICY,
+    VIEWER_POLICY,
+    ProtocolClient,
+    StreamClient,
+    broadcast,
+    broadcastStats,
+    wireTrace,
+)
+from util.logutils import WireTrace, isEmitted
+
+
+class FakeTransport(asyncio.WriteTransport):
+    """Transport which buffers everything until flush(), with the flow
+    control of the asyncio transports."""
+
+    def __init__(self) -> None:
+        super().__init__({"peername": ("127.0.0.1", 1)})
+        self.data = bytearray()  # everything written
+        self.buffered = 0
+        self.closed = False
+        self.aborted = False
+        self.paused = False
+        self.writeCalls = 0
+        self.high = 0
+        self.low = 0
+
+    def set_protocol(self, protocol) -> None:
+        self.protocol = protocol
+
+    def set_write_buffer_limits(self, high=None, low=None) -> None:
+        self.high = high
+        self.low = low
+
+    def writelines(self, chunks) -> None:
+        self.writeCalls += 1
+        self.chunks = list(chunks)
+        self.write(b"".join(self.chunks))
+
+    def write(self, data) -> None:
+        self.data += data
+        self.buffered += len(data)
+        if not self.paused and self.buffered > self.high:
+            self.paused = True
+            self.protocol.pause_writing()
+
+    def flush(self) -> None:
+        self.buffered = 0
+        if self.paused:
+            self.paused = False
+            self.protocol.resume_writing()
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+    def close(self) -> None:
+        self.closed = True
+
+    def abort(self) -> None:
+        self.closed = True
+        self.aborted = True
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffered
+
+
+class TestProtocolClient(IsolatedAsyncioTestCase):
+
+    def connect(self):
+        self.lines: List[str] = []
+        self.events: List[str] = []
+        client = ProtocolClient(
+            lambda c: self.events.append("connected"),
+            lambda c, line: self.lines.append(line),
+            lambda c: self.events.append("closed"),
+        )
+        transport = FakeTransport()
+        transport.set_protocol(client)
+        client.connection_made(transport)
+        return client, transport
+
+    async def test_lines(self):
+        client, transport = self.connect()
+        self.assertEqual(client.address, ("127.0.0.1", 1))
+        client.data_received(b"e1 bot\nal")
+        client.data_received(b"ice\n")
+        client.data_received("passé\npw".encode())
+        self.assertEqual(self.lines, ["e1 bot\n", "alice\n", "passé\n"])
+        client.data_received(b"\n")
+        self.assertEqual(self.lines[-1], "pw\n")
+
+        self.assertTrue(client.send("username", "password"))
+        await asyncio.sleep(0)
+        self.assertEqual(bytes(transport.data), b"username\npassword\n")
+        client.close()
+        self.assertTrue(transport.closed)
+        self.assertFalse(client.send("info"))
+        client.connection_lost(None)
+        self.assertEqual(self.events, ["connected", "closed"])
+
+    async def test_line_limit(self):
+        client, transport = self.connect()
+        client.data_received(b"e1 bot\n")
+        client.data_received(b"x" * (MAX_LINE // 2))
+        self.assertFalse(transport.closed)
+        client.data_received(b"x" * (MAX_LINE // 2 + 1))
+        self.assertTrue(transport.closed)
+        self.assertFalse(client.alive)
+        self.assertEqual(self.lines, ["e1 bot\n"])
+
+    async def test_cork(self):
+        client, transport = self.connect()
+        client.send("setup 1 9 7.5 300 w(1800) b(1800)")
+        client.send("genmove b 300000")
+        await asyncio.sleep(0)
+        self.assertEqual(transport.writeCalls, 1)
+        self.assertEqual(len(transport.chunks), 2)
+        self.assertEqual((client.messages, client.writes), (2, 1))
+        self.assertEqual(client.bytesSent, len(transport.data))
+
+        # close() sends what is corked first
+        client.send("Error: bye")
+        client.close()
+        self.assertTrue(transport.data.endswith(b"Error: bye\n"))
+
+    async def test_python_client(self):
+        # the first message has no new line, every message is a line
+        client, transport = self.connect()
+        client.data_received(b"v1 viewer")
+        client.data_received(b"observe 3")
+        self.assertEqual(self.lines, ["v1 viewer", "observe 3"])
+
+    async def test_write_buffer(self):
+        # a player is never dropped for being slow
+        client, transport = self.connect()
+        for _ in range(3):
+            self.assertTrue(client.send("x" * MAX_WRITE_BUFFER))
+        self.assertTrue(client.alive)
+
+        client, transport = self.connect()
+        client.setPolicy(VIEWER_POLICY)
+        self.assertTrue(client.send("x" * (MAX_WRITE_BUFFER // 2)))
+        self.assertFalse(client.send("x" * (MAX_WRITE_BUFFER // 2)))
+        self.assertTrue(transport.aborted)
+        self.assertFalse(client.alive)
+
+    async def test_coalesce(self):
+        client, transport = self.connect()
+        client.setPolicy(VIEWER_POLICY, lambda gid: f"setup {gid} moves" if gid == 1 else None)
+        self.assertEqual(transport.high, VIEWER_POLICY.high)
+        client.send("x" * VIEWER_POLICY.high)
+        await asyncio.sleep(0)
+        self.assertTrue(transport.paused)
+        start = len(transport.data)
+
+        client.sendBytes(b"update 1 D4\n", 1)
+        client.sendBytes(b"update 2 D4\n", 2)
+        client.send("info hello")
+        client.sendBytes(b"update 1 Q16\n", 1)
+        client.sendBytes(b"update 2 Q16\n", 2)
+        client.sendBytes(b"update 1 C3\n", 1)
+        # game 2 ends, its result is not coalesced
+        client.sendBytes(b"update 2 B+Resign\n")
+        self.assertEqual(len(transport.data), start)
+        self.assertEqual(client.coalesced, 5)
+
+        with self.assertLogs("cgos_server.client", level="INFO") as logs:
+            transport.flush()
+            await asyncio.sleep(0)
+        # game 2 has no resync message, its coalesced moves are lost but
+        # the result still arrives
+        self.assertEqual(
+            bytes(transport.data[start:]), b"info hello\nsetup 1 moves\nupdate 2 B+Resign\n"
+        )
+        self.assertEqual(client.resyncs, 1)
+        self.assertEqual(client.lostResyncs, 1)
+        self.assertTrue(any("no resync for game 2" in line for line in logs.output))
+
+        client.sendBytes(b"update 1 D5\n", 1)
+        await asyncio.sleep(0)
+        self.assertEqual(transport.chunks, [b"update 1 D5\n"])
+
+    async def test_handler_error(self):
+        client = ProtocolClient(lambda c: None, lambda c, line: 1 // 0, lambda c: None)
+        transport = FakeTransport()
+        transport.set_protocol(client)
+        client.connection_made(transport)
+        with self.assertLogs("cgos_server.client", level="ERROR"):
+            client.data_received(b"a\nb\n")
+        self.assertFalse(client.alive)
+        self.assertTrue(transport.closed)
+
+    async def test_broadcast(self):
+        clients = [self.connect() for _ in range(3)]
+        clients[1][0].close()
+        broadcastStats.reset()
+        gone = broadcast([c for c, _ in clients], "update 1 D4 900000")
+        self.assertEqual(gone, [clients[1][0]])
+        await asyncio.sleep(0)
+        self.assertEqual(clients[0][1].data, b"update 1 D4 900000\n")
+        self.assertIs(clients[0][1].chunks[0], clients[2][1].chunks[0])
+        self.assertEqual(broadcastStats.broadcasts, 1)
+        self.assertEqual(broadcastStats.recipients, 3)
+        self.assertEqual(broadcastStats.asdict()["bytes"], 19)
+
+
+class TestStreamClient(IsolatedAsyncioTestCase):
+
+    def connect(self):
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        transport = FakeTransport()
+        transport.set_protocol(protocol)
+        protocol.connection_made(transport)
+        writer = asyncio.StreamWriter(transport, protocol, reader, asyncio.get_running_loop())
+        client = StreamClient(reader, writer, "alice")
+        self.drains = 0
+        drain = writer.drain
+
+        async def counted():
+            self.drains += 1
+            await drain()
+
+        writer.drain = counted
+        self.task = asyncio.create_task(client.writeTask())
+        return client, transport
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def settle(self):
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    async def test_write_task(self):
+        client, transport = self.connect()
+        client.send("setup 1 9 7.5 300 w(1800) b(1800)")
+        client.send("genmove b 300000")
+        client.sendBytes(b"info hello\n")
+        await self.settle()
+        self.assertEqual(transport.writeCalls, 1)
+        self.assertEqual(len(transport.chunks), 3)
+        self.assertEqual(self.drains, 0)
+        n = len(transport.data)
+        self.assertEqual((client.messages, client.writes, client.bytesSent), (3, 1, n))
+
+        # the transport holds more than policy.high bytes after this one
+        client.send("x" * (PLAYER_POLICY.high - n))
+        await self.settle()
+        self.assertEqual(transport.writeCalls, 2)
+        self.assertEqual(self.drains, 1)
+        client.send("play w D4 1000")
+        await self.settle()
+        self.assertEqual(transport.writeCalls, 2)
+
+        transport.flush()
+        await self.settle()
+        self.assertEqual(transport.writeCalls, 3)
+        self.assertEqual(transport.chunks, [b"play w D4 1000\n"])
+        self.assertEqual(self.drains, 1)
+        self.assertEqual(client.messages, 5)
+        self.assertEqual(client.writes, 3)
+        self.assertEqual(client.bytesSent, len(transport.data))
+
+    async def test_hold_resync(self):
+        client, transport = self.connect()
+        client.setPolicy(VIEWER_POLICY, lambda gid: f"setup {gid} moves")
+        self.assertEqual(transport.high, VIEWER_POLICY.high)
+        half = "x" * (VIEWER_POLICY.high // 2)
+        client.send(half)
+        await self.settle()
+        self.assertFalse(transport.paused)
+
+        # the queue alone is below policy.high, with the transport it is above
+        client.send(half)
+        client.sendBytes(b"update 1 D4\n", 1)
+        client.send("info hello")
+        client.sendBytes(b"update 1 Q16\n", 1)
+        await self.settle()
+        self.assertTrue(transport.paused)
+        self.assertEqual(self.drains, 1)
+        start = len(transport.data)
+        client.sendBytes(b"update 1 C3\n", 1)
+        await self.settle()
+        self.assertEqual(len(transport.data), start)
+        self.assertEqual(client.coalesced, 3)
+
+        transport.flush()
+        await self.settle()
+        self.assertEqual(bytes(transport.data[start:]), b"info hello\nsetup 1 moves\n")
+        self.assertEqual(client.resyncs, 1)
+
+        client.sendBytes(b"update 1 D5\n", 1)
+        await self.settle()
+        self.assertEqual(transport.chunks, [b"update 1 D5\n"])
+
+    async def test_limit_drop(self):
+        client, transport = self.connect()
+        client.setPolicy(VIEWER_POLICY, lambda gid: f"setup {gid} moves")
+        self.assertTrue(client.send("x" * VIEWER_POLICY.high))
+        await self.settle()
+        self.assertTrue(transport.paused)
+        self.assertTrue(client.send("y" * (MAX_WRITE_BUFFER // 2)))
+        self.assertTrue(client.alive)
+        self.assertFalse(client.send("z" * (MAX_WRITE_BUFFER // 2)))
+        self.assertFalse(client.alive)
+        self.assertTrue(transport.aborted)
+
+
+class TestWireTrace(IsolatedAsyncioTestCase):
+
+    async def test_level(self):
+        logger = logging.getLogger("test_wire_trace")
+        logger.propagate = False
+        handler = logging.NullHandler(logging.INFO)
+        logger.addHandler(handler)
+        try:
+            self.assertFalse(isEmitted(logger, logging.DEBUG))
+            self.assertTrue(isEmitted(logger, logging.INFO))
+            trace = WireTrace(logger)
+            self.assertEqual(trace.connectionLevel(), 0)
+            trace.configure(1.0)
+            self.assertEqual(trace.connectionLevel(), logging.INFO)
+
+            handler.setLevel(logging.DEBUG)
+            trace.configure(0.0)
+            self.assertEqual(trace.connectionLevel(), logging.DEBUG)
+        finally:
+            logger.removeHandler(handler)
+
+    async def test_traced_connection(self):
+        try:
+            wireTrace.configure(1.0)
+            client = ProtocolClient(lambda c: None, lambda c, line: None, lambda c: None)
+            transport = FakeTransport()
+            transport.set_protocol(client)
+            client.connection_made(transport)
+            # DEBUG when a handler takes DEBUG records, as under pytest
+            self.assertIn(client.traceLevel, [logging.INFO, logging.DEBUG])
+            with self.assertLogs("cgos_server.wire", level=client.traceLevel) as cm:
+                client.data_received(b"e1 bot\n")
+                client.send("username")
+            self.assertEqual(len(cm.output), 2)
+        finally:
+            wireTrace.configure(0.0)
+        client = ProtocolClient(lambda c: None, lambda c, line: None, lambda c: None)
+        debug = isEmitted(logging.getLogger("cgos_server.wire"), logging.DEBUG)
+        self.assertEqual(client.traceLevel, logging.DEBUG if debug else 0)
@@ -0,0 +1,173 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import struct
+import tempfile
+from unittest import TestCase
+
+from app.sgffile import BIN_HEADER, LiveSgf, SgfSave, SgfWriter, decodeRecords, encodeRecord
+from gogame import sgf, sgfHeader
+from tests.fixtures import newGame
+
+
+class TestLiveSgf(TestCase):
+
+    def test_append(self):
+        game = newGame(boardsize=9)
+        args = ("cgos", 300000, "Chinese", 9, 7.5, 1, "?", "2023-01-01")
+        with tempfile.TemporaryDirectory() as tmp:
+            live = LiveSgf(os.path.join(tmp, "1.bin"), sgfHeader(game, *args))
+            for i, mv in enumerate(["E5", "C3", "pass", "G7"]):
+                comment = "x" * 100 * i
+                game.add_move(mv, 1000, '{"comment":"' + comment + '"}', comment)
+                live.appendNodes(game.sgfBody(9))
+                with open(live.path, "rb") as f:
+                    data = f.read()
+                self.assertEqual(len(data), live.size)
+                expected = sgf(game, *args, "").replace("CZ[]", "")
+                self.assertEqual("".join(decodeRecords(data)) + ")\n", expected)
+
+            # a record of every node, the long comment is compressed
+            self.assertEqual(len(decodeRecords(data)), 5)
+            with open(live.indexPath, "rb") as f:
+                index = f.read()
+            offsets = struct.unpack(f"<{len(index) // 4}I", index)
+            self.assertEqual(offsets[0], BIN_HEADER.size)
+            (size,) = struct.unpack_from("<i", data, offsets[4])
+            self.assertLess(size, 0)
+            self.assertEqual(offsets[4] + 4 - size, len(data))
+
+            # an incomplete record is not returned
+            self.assertEqual(len(decodeRecords(data[:-1])), 4)
+
+            live.remove()
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_append_error(self):
+        game = newGame(boardsize=9)
+        args = ("cgos", 300000, "Chinese", 9, 7.5, 1, "?", "2023-01-01")
+        with tempfile.TemporaryDirectory() as tmp:
+            live = LiveSgf(os.path.join(tmp, "1.bin"), sgfHeader(game, *args))
+            live.append([";B[ee]BL[299]"])
+            with open(live.indexPath, "rb") as f:
+                index = f.read()
+
+            # the record is written, the index is not
+            os.remove(live.indexPath)
+            os.mkdir(live.indexPath)
+            with self.assertRaises(OSError):
+                live.append([";W[cc]WL[299]"])
+            os.rmdir(live.indexPath)
+            with open(live.indexPath, "wb") as f:
+                f.write(index)
+
+            live.append([";W[gg]WL[298]"])
+            with open(live.path, "rb") as f:
+                data = f.read()
+            self.assertEqual(len(data), live.size)
+            self.assertEqual(decodeRecords(data)[1:], [";B[ee]BL[299]", ";W[gg]WL[298]"])
+            with open(live.indexPath, "rb") as f:
+                index = f.read()
+            offsets = struct.unpack(f"<{len(index) // 4}I", index)
+            self.assertEqual(len(offsets), 3)
+            (size,) = struct.unpack_from("<i", data, offsets[2])
+            self.assertEqual(offsets[2] + 4 + abs(size), len(data))
+
+    def test_dictionary(self):
+        game = newGame(boardsize=9)
+        for mv in ["E5", "C3", "pass", "G7", "D4", "F6"]:
+            game.add_move(mv, 299000, None)
+        args = ("cgos", 300000, "Chinese", 9, 7.5, 1, "?", "2023-01-01")
+        expected = sgf(game, *args, "").replace("CZ[]", "")
+        with tempfile.TemporaryDirectory() as tmp:
+            sizes = []
+            for dictionary in [0, 1]:
+                live = LiveSgf(os.path.join(tmp, f"{dictionary}.bin"), sgfHeader(game, *args), dictionary)
+                live.appendNodes(game.sgfBody(9))
+                with open(live.path, "rb") as f:
+                    data = f.read()
+                self.assertEqual(data[5], dictionary)
+                self.assertEqual("".join(decodeRecords(data)) + ")\n", expected)
+                sizes.append(len(data))
+            self.assertLess(sizes[1], sizes[0])
+
+        # short move nodes only compress with the dictionary
+        node = ";B[ee]BL[299]"
+        self.assertEqual(len(encodeRecord(node, 0)), 4 + len(node))
+        self.assertLess(len(encodeRecord(node, 1)), 4 + len(node))
+
+    def test_writer(self):
+        game = newGame(boardsize=9)
+        args = ("cgos", 300000, "Chinese", 9, 7.5, 1, "?", "2023-01-01")
+        header = sgfHeader(game, *args)
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = SgfWriter(10)
+
+            def save(final):
+                text = sgf(game, *args, "")
+                return SgfSave(1, tmp, text, header, tuple(game.sgfBody(9)), final, False)
+
+            # the thread can not take saves while the lock is held
+            with writer._cond:
+                for mv in ["E5", "C3", "G7"]:
+                    game.add_move(mv, 1000, None)
+                    writer.submit(save(False))
+                self.assertEqual(writer.depth(), 1)
+            writer.flush()
+            self.assertEqual((writer.submitted, writer.written, writer.coalesced), (3, 1, 2))
+            with open(os.path.join(tmp, "1.bin"), "rb") as f:
+                self.assertEqual(len(decodeRecords(f.read())), 4)
+            with open(os.path.join(tmp, "1.sgf")) as f:
+                self.assertEqual(f.read(), sgf(game, *args, ""))
+
+            game.add_move("pass", 1000, None)
+            writer.submit(save(False))
+            writer.submit(save(True))
+            writer.close()
+            self.assertEqual(sorted(os.listdir(tmp)), ["1.sgf"])
+            self.assertEqual(writer.errors, 0)
+            self.assertIn("written:", writer.stats())
+
+    def test_writer_full(self):
+        game = newGame(boardsize=9)
+        args = ("cgos", 300000, "Chinese", 9, 7.5, 1, "?", "2023-01-01")
+        header = sgfHeader(game, *args)
+        game.add_move("E5", 1000, None)
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = SgfWriter(1)
+
+            def save(gid, final):
+                text = sgf(game, *args, "")
+                return SgfSave(gid, tmp, text, header, tuple(game.sgfBody(9)), final, False)
+
+            # submit does not wait for the thread which can not run
+            with writer._cond:
+                writer.submit(save(1, False))
+                with self.assertLogs("cgos_server.sgffile", level="INFO"):
+                    writer.submit(save(2, False))
+                writer.submit(save(3, True))
+                self.assertEqual(writer.depth(), 2)
+            writer.close()
+            self.assertEqual(writer.dropped, 1)
+            self.assertEqual(sorted(os.listdir(tmp)), ["1.bin", "1.idx", "1.sgf", "3.sgf"])
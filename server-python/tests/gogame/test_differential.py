@@ -0,0 +1,189 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import random
+from typing import List
+from unittest import TestCase
+
+from gogame import Board, GoGame, Rule, KoRule
+from gogame.playout import random_move
+
+
+COORDINATES = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+
+
+class ReferenceGoGame:
+    """Straightforward rules engine comparing full board copies.
+
+    It mirrors the original GoGame implementation and is used as an oracle
+    for the optimized engine.
+    """
+
+    def __init__(self, size: int, koRule: KoRule) -> None:
+        self.size = size
+        self.size1 = size + 1
+        self.koRule = koRule
+        self.dir = [-1, 1, self.size1, -self.size1]
+        self.bd = []
+        for y in range(size + 2):
+            for x in range(self.size1):
+                if y < 1 or y > size or x == 0:
+                    self.bd.append(3)
+                else:
+                    self.bd.append(0)
+        self.his: List[List[int]] = [self.bd.copy()]
+
+    def capture_group(self, target: int) -> List[int]:
+        est = self.bd[target]
+        group = [target]
+        seen = {target}
+        for ix in group:
+            for d in self.dir:
+                p = ix + d
+                if self.bd[p] == 0:
+                    return []
+                if self.bd[p] == est and p not in seen:
+                    seen.add(p)
+                    group.append(p)
+        for ix in group:
+            self.bd[ix] = 0
+        return group
+
+    def make(self, mv: str) -> int:
+        ctm = len(self.his) - 1
+        fst = 2 - (ctm & 1)
+        est = fst ^ 3
+        if mv == "PASS":
+            self.his.append(self.bd.copy())
+            return 0
+        x = COORDINATES.index(mv[0]) + 1
+        y = self.size1 - int(mv[1:])
+        ix = y * self.size1 + x
+        if self.bd[ix] != 0:
+            return -3
+        self.bd[ix] = fst
+        clist = []
+        for d in self.dir:
+            if self.bd[ix + d] == est:
+                clist.extend(self.capture_group(ix + d))
+        if len(clist) == 0 and len(self.capture_group(ix)) > 0:
+            self.bd = self.his[ctm].copy()
+            return -1
+        if self.koRule == KoRule.POSITIONAL:
+            previous = self.his[:ctm]
+        else:
+            previous = self.his[ctm - 1:ctm]
+        if self.bd in previous:
+            self.bd = self.his[ctm].copy()
+            return -2
+        self.his.append(self.bd.copy())
+        return len(clist)
+
+
+class TestDifferential(TestCase):
+
+    def play_random(self, size: int, koRule: KoRule, seed: int, length: int):
+        rng = random.Random(seed)
+        game = GoGame(size, Rule(koRule))
+        ref = ReferenceGoGame(size, koRule)
+        vertices = {
+            (ref.size1 - y) * ref.size1 + x + 1: f"{COORDINATES[x]}{y}"
+            for x in range(size)
+            for y in range(1, size + 1)
+        }
+        for n in range(length):
+            # mostly empty points, sometimes an occupied one or a pass
+            empty = [mv for ix, mv in vertices.items() if ref.bd[ix] == 0]
+            r = rng.random()
+            if r < 0.03 or len(empty) == 0:
+                mv = "PASS"
+            elif r < 0.06:
+                mv = rng.choice(list(vertices.values()))
+            else:
+                mv = rng.choice(empty)
+            expected = ref.make(mv)
+            self.assertEqual(game.make(mv), expected, f"seed {seed} move {n} {mv}")
+            self.assertEqual(list(game.bd), ref.bd, f"seed {seed} move {n} {mv}")
+            self.assertChains(game.board)
+
+    def assertChains(self, board: Board):
+        expected = Board(board.size)
+        expected.bd = board.bd.copy()
+        expected.rebuild()
+        self.assertEqual(board.hash, expected.hash)
+        for ix, c in enumerate(board.bd):
+            if c != 1 and c != 2:
+                continue
+            self.assertEqual(
+                set(board.chain_stones(ix)), set(expected.chain_stones(ix))
+            )
+            self.assertEqual(board.libs[board.chain[ix]], expected.libs[expected.chain[ix]])
+
+    def test_random_positional(self):
+        for seed in range(40):
+            self.play_random(5, KoRule.POSITIONAL, seed, 300)
+        for seed in range(5):
+            self.play_random(9, KoRule.POSITIONAL, seed, 400)
+
+    def test_random_simple(self):
+        for seed in range(40):
+            self.play_random(5, KoRule.SIMPLE, seed, 300)
+        for seed in range(5):
+            self.play_random(9, KoRule.SIMPLE, seed, 400)
+
+    def test_unmake(self):
+        game = GoGame(5, Rule(KoRule.POSITIONAL))
+        rng = random.Random(1)
+        boards = [game.to_string()]
+        positions = [game.bd.copy()]
+        while len(boards) < 100:
+            if rng.random() < 0.1:
+                mv = "PASS"
+            else:
+                mv = f"{rng.choice(COORDINATES[:5])}{rng.randint(1, 5)}"
+            if game.make(mv) >= 0:
+                boards.append(game.to_string())
+                positions.append(game.bd.copy())
+        for ply, bd in enumerate(positions):
+            self.assertEqual(game.position_at(ply), bd)
+        while game.unmake():
+            boards.pop()
+            self.assertEqual(game.to_string(), boards[-1])
+            self.assertChains(game.board)
+        self.assertEqual(game.positions, {0: 1})
+        self.assertEqual(game.list_moves(), [])
+
+    def test_unmake_each_move(self):
+        for seed in range(5):
+            game = GoGame(9, Rule(KoRule.POSITIONAL))
+            rng = random.Random(seed)
+            for n in range(300):
+                before = game.bd.copy()
+                ix = random_move(game, rng)
+                after = game.bd.copy()
+                self.assertTrue(game.unmake())
+                self.assertEqual(game.bd, before, f"seed {seed} move {n}")
+                self.assertEqual(game.ctm, n)
+                self.assertChains(game.board)
+                self.assertGreaterEqual(game.play(ix, False), 0)
+                self.assertEqual(game.bd, after)
+                self.assertChains(game.board)
@@ -20,10 +20,16 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import json
+import random
+import struct
 import textwrap
 from unittest import TestCase
 
-from gogame import GoGame, Rule, KoRule
+from gogame import GoGame, Move, MoveList, Rule, KoRule, RepetitionLog, analysisComment, geometry, sgf
+from gogame.go import SNAPSHOT_HEADER
+from gogame.playout import random_playout
+from tests.fixtures import newGame
 
 
 class TestGoGame(TestCase):
@@ -62,6 +68,61 @@ class TestGoGame(TestCase):
         self.assertEqual(board.make("K1"), -4)
         self.assertEqual(board.make("M1"), -4)
 
+    def test_move_spelling(self):
+        board = GoGame(9, Rule(KoRule.POSITIONAL))
+        self.assertEqual(board.mvToIndex("c3"), board.mvToIndex("C3"))
+        self.assertEqual(board.mvToIndex("C03"), board.mvToIndex("C3"))
+        self.assertEqual(board.mvToIndex("pass"), 0)
+        self.assertEqual(board.mvToIndex("Pa"), 0)
+        self.assertEqual(board.mvToIndex("C3x"), -4)
+        self.assertEqual(board.make("c03"), 0)
+        self.assertEqual(board.make("pass"), 0)
+        self.assertEqual(board.list_moves(), ["C3", "PASS"])
+
+    def test_sgf_points(self):
+        game = newGame([Move("A19", 0, None, None), Move("t1", 0, None, None),
+                        Move("j10", 0, None, None), Move("pass", 0, None, None)])
+        s = sgf(game, "cgos", 0, "Chinese", 19, 7.5, 1, "?", "2023-01-01", "")
+        self.assertIn(";B[aa]BL[0];W[ss]WL[0];B[ij]BL[0];W[]WL[0]", s)
+
+    def test_sgf_analysis(self):
+        info = json.loads('{"winrate":0.5,"comment":"a]b"}')
+        self.assertEqual(analysisComment(info), "a]b")
+        self.assertIsNone(analysisComment({"winrate": 0.5}))
+        self.assertIsNone(analysisComment([1]))
+        game = newGame()
+        game.add_move("D4", 1000, json.dumps(info, separators=(",", ":")), analysisComment(info))
+        s = sgf(game, "cgos", 0, "Chinese", 19, 7.5, 1, "?", "2023-01-01", "")
+        self.assertIn(';B[dp]BL[1]CC[{"winrate":0.5,"comment":"a\\]b"}]\nC[a\\]b]', s)
+
+    def test_sgf_incremental(self):
+        moves = [Move(f"{c}{n}", 1000 * n, None, None) for c in "ABCDEFGHJ" for n in range(1, 4)]
+        game = newGame(boardsize=9)
+        for i, (mv, t, analysis, comment) in enumerate(moves):
+            game.add_move(mv, t, analysis, comment)
+            self.assertEqual(len(game.sgfNodes), i + 1)
+            s = sgf(game, "cgos", 0, "Chinese", 9, 7.5, 1, "?", "2023-01-01", "")
+            full = newGame(moves[:i + 1])
+            self.assertEqual(s, sgf(full, "cgos", 0, "Chinese", 9, 7.5, 1, "?", "2023-01-01", ""))
+        self.assertIn(";B[ai]BL[1];W[ah]WL[2];B[ag]BL[3];W[bi]WL[1]", s)
+        self.assertEqual(s.count("\n"), 3 + 27 // 8 + 1)
+
+    def test_replay(self):
+        moves = ["C3", "d3", "D4", "C4", "B4", "B3", "C5", "C2", "pass", "C1"]
+        board = GoGame(9, Rule(KoRule.POSITIONAL))
+        self.assertEqual(board.replay(moves), (-1, 0))
+        expected = GoGame(9, Rule(KoRule.POSITIONAL))
+        for mv in moves:
+            expected.make(mv)
+        self.assertEqual(board.to_string(), expected.to_string())
+        self.assertEqual(board.list_moves(), expected.list_moves())
+
+        board = GoGame(9, Rule(KoRule.POSITIONAL))
+        self.assertEqual(board.replay(["C3", "D3", "C3", "E3"]), (2, -3))
+        self.assertEqual(board.list_moves(), ["C3", "D3"])
+        board = GoGame(9, Rule(KoRule.POSITIONAL))
+        self.assertEqual(board.replay(["C3", "Z3"]), (1, -4))
+
     def test_move_occupied(self):
         board = GoGame(9, Rule(KoRule.POSITIONAL))
         self.assertEqual(board.make("C3"), 0)
@@ -136,6 +197,20 @@ class TestGoGame(TestCase):
                          ..XO.
                          """))
 
+    def test_getboard(self):
+        board = GoGame.from_string(
+            textwrap.dedent("""\
+                            O..
+                            .X.
+                            ..X
+                            """),
+            Rule(KoRule.POSITIONAL))
+        self.assertEqual(board.getboard(), [1, 0, 0, 0, 2, 0, 0, 0, 2])
+        self.assertEqual(board.board.snapshot(), bytes([1, 0, 0, 0, 2, 0, 0, 0, 2]))
+        view = board.board.view()
+        self.assertEqual(len(view), 5 * 4)
+        self.assertEqual(view[2 * 4 + 2], 2)
+
     def test_positional_ko(self):
         BOARD = textwrap.dedent("""\
             .o.xxo
@@ -258,3 +333,126 @@ class TestGoGame(TestCase):
             """)
         board = GoGame.from_string(BOARD, Rule(KoRule.POSITIONAL))
         self.assertEqual(board.ttScore(), 1 - 7)
+
+    def test_repetition_log(self):
+        BOARD = textwrap.dedent("""\
+            .o.xxo
+            oxxxo.
+            o.x.oo
+            xx.oo.
+            oooo.o
+            oooooo
+            """)
+        try:
+            GoGame.repetitionLog = RepetitionLog.FULL
+            board = GoGame.from_string(BOARD, Rule(KoRule.POSITIONAL))
+            self.assertEqual(board.make("F5"), 1)
+            with self.assertLogs("cgos_server", level="INFO") as cm:
+                self.assertEqual(board.make("F6"), -2)
+            self.assertEqual(cm.output, ["INFO:cgos_server:KO positional: 0 == 1 F6"])
+
+            GoGame.repetitionLog = RepetitionLog.OFF
+            with self.assertNoLogs("cgos_server", level="INFO"):
+                self.assertEqual(board.make("F6"), -2)
+        finally:
+            GoGame.repetitionLog = RepetitionLog.OFF
+
+    def test_random_playout(self):
+        board = GoGame(9, Rule(KoRule.POSITIONAL))
+        random_playout(board, random.Random(1))
+        self.assertTrue(board.twopass() or board.ctm == 3 * 9 * 9)
+        replayed = GoGame(9, Rule(KoRule.POSITIONAL))
+        self.assertEqual(replayed.replay(board.list_moves()), (-1, 0))
+        self.assertEqual(replayed.to_string(), board.to_string())
+
+    def test_to_bytes(self):
+        board = GoGame(9, Rule(KoRule.SIMPLE))
+        random_playout(board, random.Random(2))
+        data = board.to_bytes()
+        restored = GoGame.from_bytes(data)
+        self.assertEqual(restored.rule.koRule, KoRule.SIMPLE)
+        self.assertEqual(restored.ctm, board.ctm)
+        self.assertEqual(restored.bd, board.bd)
+        self.assertEqual(restored.list_moves(), board.list_moves())
+        self.assertEqual(restored.undo, board.undo)
+        self.assertEqual(restored.keyframes, board.keyframes)
+        self.assertEqual(restored.hashes, board.hashes)
+        self.assertEqual(restored.positions, board.positions)
+        self.assertEqual(restored.to_bytes(), data)
+
+        # the restored game goes on like the original one
+        for mv in ["pass", "pass"]:
+            board.make(mv)
+            restored.make(mv)
+        self.assertTrue(restored.twopass())
+        self.assertTrue(restored.unmake())
+        self.assertTrue(board.unmake())
+        self.assertEqual(restored.to_bytes(), board.to_bytes())
+
+        with self.assertRaises(ValueError):
+            GoGame.from_bytes(data[:-1])
+        with self.assertRaises(ValueError):
+            GoGame.from_bytes(b"XXXX" + data[4:])
+
+    def test_from_bytes_corrupt(self):
+        board = GoGame(9, Rule(KoRule.POSITIONAL))
+        random_playout(board, random.Random(3), 80)
+        data = bytearray(board.to_bytes())
+        size = len(board.bd)
+        moves = SNAPSHOT_HEADER.size + size
+        captures = moves + 4 * board.ctm
+        plies = captures + 2 * sum(len(c) for _, c in board.undo)
+
+        def corrupt(offset, fmt, value):
+            bad = bytearray(data)
+            struct.pack_into(fmt, bad, offset, value)
+            with self.assertRaises(ValueError):
+                GoGame.from_bytes(bytes(bad))
+
+        # board size above 25 and 0
+        corrupt(5, "<B", 26)
+        corrupt(5, "<B", 0)
+        # a move outside the board and on the border
+        corrupt(moves, "<H", 60000)
+        corrupt(moves, "<H", 10)
+        # a capture outside the board
+        self.assertGreater(plies, captures)
+        corrupt(captures, "<H", 60000)
+        # keyframes which are not every KEYFRAME_INTERVAL, or past the last ply
+        corrupt(plies + 4, "<I", 33)
+        corrupt(plies + 4, "<I", 96)
+        with self.assertRaises(ValueError):
+            GoGame.from_bytes(bytes(data[:8]))
+
+    def test_geometry(self):
+        a = GoGame(9, Rule(KoRule.POSITIONAL))
+        b = GoGame(9, Rule(KoRule.POSITIONAL))
+        self.assertIs(a.board.geometry, b.board.geometry)
+        self.assertIs(a.vertices, geometry(9).vertices)
+        a.make("E5")
+        self.assertEqual(b.to_string(), ".........\n" * 9)
+        self.assertEqual(bytes(b.bd), geometry(9).template)
+        self.assertEqual(len(geometry(9).points), 81)
+
+    def test_move_list(self):
+        moves = [
+            Move("D4", 900000, None, None),
+            Move("q16", 899000, '{"moves":[]}', "joseki"),
+            Move("pass", 898000, None, None),
+            Move("PASS", 897000, "", None),
+            Move("resign", 896000, None, None),
+        ]
+        ml = MoveList(19, moves)
+        self.assertEqual(len(ml), 5)
+        self.assertEqual(list(ml), moves)
+        self.assertEqual(ml[-1], moves[-1])
+        self.assertEqual(list(ml[1:3]), moves[1:3])
+        self.assertEqual(ml.spellings, ["q16", "pass", "resign"])
+        self.assertEqual(ml.wire(), " ".join(f"{m.move} {m.time}" for m in moves))
+        self.assertIs(ml.wire(), ml.wire())
+        ml.append(Move("Q16", 1, None, None))
+        self.assertEqual(ml.wire(), " ".join(f"{m.move} {m.time}" for m in moves) + " Q16 1")
+        self.assertEqual(ml[:2].wire(), "D4 900000 q16 899000")
+        self.assertEqual(MoveList(9).wire(), "")
+        with self.assertRaises(IndexError):
+            ml[6]
@@ -0,0 +1,101 @@
+# The MIT License
+#
+# Copyright (c) 2023 Kensuke Matsuzaki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import random
+import unittest
+from typing import List
+
+from gogame import GoGame, Rule, KoRule
+from gogame.score import np, score_area_numpy, score_area_union_find
+
+
+def reference_final_board(board: bytes, size: int) -> List[int]:
+    # flood fill every empty region, as the original score_board did
+    b = list(board)
+    seen = set()
+    for i in range(size * size):
+        if b[i] != 0 or i in seen:
+            continue
+        region = [i]
+        seen.add(i)
+        cc = 0
+        for p in region:
+            x, y = p % size, p // size
+            for q, ok in [(p - 1, x > 0), (p + 1, x < size - 1),
+                          (p - size, y > 0), (p + size, y < size - 1)]:
+                if not ok:
+                    continue
+                if board[q] == 0 and q not in seen:
+                    seen.add(q)
+                    region.append(q)
+                else:
+                    cc |= board[q]
+        if cc == 1 or cc == 2:
+            for p in region:
+                b[p] = cc
+    return b
+
+
+def random_board(rng: random.Random, size: int) -> bytes:
+    density = rng.random()
+    return bytes(
+        [rng.choice([1, 2]) if rng.random() < density else 0 for _ in range(size * size)]
+    )
+
+
+class TestScore(unittest.TestCase):
+
+    def test_union_find(self):
+        rng = random.Random(0)
+        for size in [1, 2, 5, 9, 13, 19]:
+            for _ in range(50):
+                board = random_board(rng, size)
+                score = score_area_union_find(board, size)
+                self.assertEqual(list(score.board), reference_final_board(board, size))
+                for i, r in enumerate(score.regions):
+                    self.assertEqual(r < 0, board[i] != 0)
+                    if r >= 0:
+                        self.assertEqual(score.territory[i], score.owners[r])
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_numpy(self):
+        rng = random.Random(1)
+        for size in [1, 2, 5, 9, 13, 19]:
+            for _ in range(50):
+                board = random_board(rng, size)
+                expected = score_area_union_find(board, size)
+                score = score_area_numpy(board, size)
+                self.assertEqual(score.board, expected.board)
+                self.assertEqual(score.territory, expected.territory)
+                self.assertEqual(score.regions, expected.regions)
+                self.assertEqual(score.owners, expected.owners)
+                self.assertEqual(score.score, expected.score)
+
+    def test_dead_stones(self):
+        board = GoGame(5, Rule(KoRule.POSITIONAL))
+        for mv in ["B1", "A2", "B2", "A3", "B3", "A4", "B4", "A5", "B5"]:
+            board.make(mv)
+        self.assertEqual(board.ttScore(), 5 + 15 - 4)
+        score = board.score(["A2", "A3", "A4", "A5"])
+        self.assertEqual(score.score, 25)
+        self.assertEqual(score.owners, [2, 2])
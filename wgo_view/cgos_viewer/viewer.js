@@ -29,6 +29,25 @@
     const FORCE_UPDATE_SGF = true;
     const USE_FETCH = true;
     const VALID_SGF_PATH = "^[/a-zA-Z0-9.]*(\\?_=[0-9]*)?$";
+    const BIN_MAGIC = 0x42534743;  // "CGSB" little endian
+    const BIN_VERSION = 2;
+    const BIN_HEADER_SIZE = 8;
+    // preset dictionaries of the .bin records, the same bytes as ZDICTS
+    // in server-python/cgos/app/sgffile.py
+    const ZDICTS = {
+        1: new TextEncoder().encode(
+            "(;GM[1]FF[4]CA[UTF-8]\nRU[Chinese]SZ[19]KM[7.5]TM[900]\nPW[PB[WR[BR[DT[PC[RE[?         ]GN["
+            + '"scoreStdev":"lcb":"utility":"scoreMean":"custom":{'
+            + '"ownership":"AAAAAAAAAAAAAAAAAAA999999999999999999"'
+            + '"visits":"winrate":0.5"score":0.'
+            + ";C[Q16 D4 Q4 D16 R16 C4 R4 C16 Q3 D17 R17 C3 "
+            + '"order":0,"prior":0.0'
+            + '},{"move":"'
+            + '"pv":"D4 Q16 Q4 D16 '
+            + ';B[]BL[;W[]WL['
+            + ']\nCC[{"moves":[{"move":"'
+            + "]WL[8]BL[8;W[;B["),
+    };
 
     let updateCheckbox;
     let player;
@@ -68,6 +87,8 @@
         .then(r => {
             if (r.ok) {
                 return r.arrayBuffer();
+            } else if (r.status == 416) {
+                return null;  // no new records since the last fetch
             } else {
                 if (r.status == 404) {
                     if (player && player.kifu && player.kifu.nodeCount > 0) {
@@ -94,34 +115,40 @@
             sgfBuffer.set(new Uint8Array(buf), startPos);
             sgfSize = size;
 
+            // header "CGSB", version, dictionary, 2 reserved bytes, then
+            // records of int32 length (negative if deflated) and an SGF fragment
+            const view = new DataView(sgfBuffer.buffer);
+            if (sgfSize < BIN_HEADER_SIZE || view.getUint32(0, true) != BIN_MAGIC
+                || view.getUint8(4) != BIN_VERSION) {
+                useRangeFetch = false;
+                return;
+            }
+            const dictionary = view.getUint8(5);
+            if (dictionary != 0 && !(dictionary in ZDICTS)) {
+                useRangeFetch = false;
+                return;
+            }
             let sgf = "";
             const decoder = new TextDecoder();
-            const view = new DataView(sgfBuffer.buffer);
-            for (let i = 0; i < sgfSize;) {
+            let i = BIN_HEADER_SIZE;
+            while (i + 4 <= sgfSize) {
                 let size = view.getInt32(i, true);
-                let buf;
-                if (size < 0) {
+                const compressed = size < 0;
+                if (compressed)
                     size = -size;
-                    buf = pako.inflate(new Uint8Array(sgfBuffer.buffer, i + 4, size));
-                } else {
-                    buf = new Uint8Array(sgfBuffer.buffer, i + 4, size);
-                }
-                const chunk = decoder.decode(buf);
-                // console.log(i, chunk);
-                if (chunk.indexOf('CZ[]') > 0) {
-                    lastSgfPos = i;
-                }
-
-                sgf += chunk;
-
+                if (i + 4 + size > sgfSize)
+                    break;  // the rest of the record is not written yet
+                let buf = new Uint8Array(sgfBuffer.buffer, i + 4, size);
+                if (compressed && dictionary == 0)
+                    buf = pako.inflate(buf);
+                else if (compressed)
+                    buf = pako.inflateRaw(buf, { dictionary: ZDICTS[dictionary] });
+                sgf += decoder.decode(buf);
                 i += 4 + size;
             }
-            // console.log(sgf);
-            if (!sgf.trim().endsWith(")")) {
-                console.log("ignroe bad sgf", sgf)
-                //pollSgf();
-                return;
-            }
+            // records are never rewritten, continue after the last complete one
+            lastSgfPos = i;
+            sgf += ")";
             player.loadSgf(sgf, END_MOVES);
             player.updateDimensions();
         });